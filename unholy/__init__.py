@@ -4,18 +4,21 @@ import functools
 import subprocess
 import sys
 import time
+from typing import TYPE_CHECKING
 
 import click
 
-from .compose import (
-    UnholyCompose,
-)
 from .config import (
-    edit_config, get_config_stack, get_script_stack, project_config_path,
-    list_projects,
+    edit_config, get_config_stack, get_stack, project_config_path,
+    list_projects, project_index,
 )
 from .git import guess_project_from_url, pull_file
-from .processes import do_clone
+
+# docker-py is slow to import, so the modules that need it are only imported
+# by the commands that use them. This keeps ls, --help, and completion quick.
+if TYPE_CHECKING:
+    from .aio import AsyncUnholyCompose
+    from .compose import UnholyCompose
 
 
 #: The container image to use for nvim
@@ -35,10 +38,11 @@ def format_exceptions(func):
                 f"Call to `{' '.join(map(str, exc.cmd))}` failed", fg='red',
                 err=True,
             )
-            if exc.stderr is not None:
-                sys.stderr.write(exc.stderr)
-            elif exc.stdout is not None:
-                sys.stderr.write(exc.stdout)
+            output = exc.stderr if exc.stderr is not None else exc.stdout
+            if isinstance(output, bytes):
+                output = output.decode('utf-8', 'replace')
+            if output is not None:
+                sys.stderr.write(output)
             sys.exit(exc.returncode)
     return _
 
@@ -56,11 +60,19 @@ def main():
 @click.option('--remote', '--origin', '-o', help="Name of the remote (default: origin)")
 @click.option('--branch', '-b', help="Name of the branch to check out (default: remote's HEAD)")
 @click.option('--context', '-c', help="Name of the docker context to use (default: unset)")
+@click.option('--depth', type=int, help="Only clone this many commits of history (default: clone.depth)")
+@click.option('--filter', help="Partial clone filter, eg blob:none (default: clone.filter)")
+@click.option('--sparse', multiple=True, help="Only check out this directory; may be repeated (default: clone.sparse)")
+@click.option('--reference', help="Borrow objects from this repository in the bootstrap container (default: clone.reference)")
 @format_exceptions
-def new(name, repository, branch, remote, context):
+def new(name, repository, branch, remote, context, depth, filter, sparse, reference):
     """
     Create a new project from a git repo
     """
+    import asyncio
+    from .aio import AsyncUnholyCompose
+    from .compose import UnholyCompose
+
     name = name or guess_project_from_url(repository)
     if project_config_path(name).exists():
         click.confirm(
@@ -85,12 +97,12 @@ def new(name, repository, branch, remote, context):
         # Not recording branch or remote--they're only pertinent to initial set up.
 
     # The full proper config stack
-    config = get_config_stack(project_name=name, project_config=uf)
+    stack = get_stack(project_name=name, project_config=uf)
+    config = stack.config
 
     # Do initialization
     composer = UnholyCompose(name, config)
-    if (c := composer.devenv_get()) is not None:
-        c.remove(force=True)
+    composer.devenv_delete()
 
     if composer.workspace_get() is not None:
         click.confirm(
@@ -100,35 +112,56 @@ def new(name, repository, branch, remote, context):
         # Git really wants an empty directory, so it's easiest to just recreate
         # the workspace.
         composer.workspace_delete()
-    composer.workspace_create()
-
-    with composer.bootstrap_spawn() as container:
-        do_clone(container, composer.WORKSPACE_MOUNTPOINT, config, branch=branch, remote=remote)
-        # Compose usually fails because of container problems. We mostly care about networks and volumes.
-        composer.compose_run('up', '--detach', container=container, check=False)
 
-    composer.devenv_create(
-        get_script_stack(project_name=name, project_config=uf),
-    )
+    asyncio.run(_new_async(
+        AsyncUnholyCompose(composer), config, stack.scripts,
+        branch=branch, remote=remote,
+        depth=depth, filter=filter, sparse=sparse or None, reference=reference,
+    ))
 
     click.echo("")
     click.secho(f"Project {name} created in {context or 'Docker'}", fg='green')
 
 
+async def _new_async(composer: 'AsyncUnholyCompose', config, scripts, *, branch, remote, **clone_opts):
+    """
+    The docker parts of :func:`new`.
+    """
+    import asyncio
+    from .processes import do_clone
+
+    # The workspace doesn't need the images
+    await asyncio.gather(composer.pull_images(), composer.workspace_create())
+
+    async with composer.bootstrap_spawn() as container:
+        await asyncio.to_thread(
+            do_clone, container, composer.WORKSPACE_MOUNTPOINT, config,
+            branch=branch, remote=remote, **clone_opts,
+        )
+        # Compose usually fails because of container problems. We mostly care about networks and volumes.
+        await composer.compose_run('up', '--detach', container=container, check=False)
+
+    await composer.devenv_create(scripts)
+
+
 @dataclass
 class UnholyBits:
     #: Unholyfile contents from the project
     unholyfile: str
     #: Config stack
     config: Mapping
+    #: Script stack
+    scripts: list[str]
     #: Compose for invoking docker
-    compose: UnholyCompose
+    compose: 'UnholyCompose'
 
 
 def get_bits(name: str) -> UnholyBits:
     """
     Does the right invocations to produce a configured compose.
     """
+    from .compose import UnholyCompose
+
     # Start with mostly-complete versions of these objects.
     config = get_config_stack(project_name=name)
     composer = UnholyCompose(name, config)
@@ -137,35 +170,148 @@ def get_bits(name: str) -> UnholyBits:
     except FileNotFoundError:
         uf = ""
 
-    # Recreate these with more complete info
-    config = get_config_stack(project_name=name, project_config=uf)
-    composer = UnholyCompose(name, config)
+    # Update these with more complete info
+    stack = get_stack(project_name=name, project_config=uf)
+    composer = composer.with_config(stack.config)
     return UnholyBits(
         unholyfile=uf,
-        config=config,
+        config=stack.config,
+        scripts=stack.scripts,
         compose=composer,
     )
 
 
+def multi_project(func):
+    """
+    Lets a command take any number of projects (or --all).
+
+    With one, the command just runs. With several, each is run in a
+    subprocess, in parallel, and a summary is shown at the end.
+    """
+    @click.argument('names', nargs=-1, metavar='NAME...')
+    @click.option('--all', 'all_projects', is_flag=True, help="Do every project")
+    @click.option(
+        '--jobs', '-j', type=click.IntRange(min=1), default=2, show_default=True,
+        help="With several projects, how many to do at once per Docker context",
+    )
+    @functools.wraps(func)
+    def _(names, all_projects, jobs, **kwargs):
+        if all_projects:
+            names = list(list_projects())
+        elif not names:
+            raise click.UsageError("No projects given")
+        names = list(dict.fromkeys(names))
+        if not names:
+            click.echo("No projects")
+            return
+        if len(names) == 1 and not all_projects:
+            return func(names[0], **kwargs)
+
+        from .batch import run_batch, print_summary
+
+        # Pass our other options along
+        ctx = click.get_current_context()
+        args = [ctx.info_name]
+        for param in ctx.command.params:
+            if not isinstance(param, click.Option) or param.name not in kwargs:
+                continue
+            value = kwargs[param.name]
+            if param.is_flag:
+                if value:
+                    args.append(param.opts[0])
+            elif value is not None:
+                args += [param.opts[0], str(value)]
+
+        results = run_batch(args, names, jobs=jobs)
+        print_summary(results)
+        if any(result.returncode for result in results):
+            sys.exit(1)
+    return _
+
+
 @main.command()
-@click.argument('name')
+@multi_project
+@click.option('--fresh', is_flag=True, help="Provision from scratch, even if there's a snapshot")
 @format_exceptions
-def remake(name):
+def remake(name, fresh):
     """
     Recreate the devenv.
     """
+    import asyncio
+    from .aio import AsyncUnholyCompose
+
     unholy = get_bits(name)
+    asyncio.run(_remake_async(
+        AsyncUnholyCompose(unholy.compose), unholy.scripts,
+        fresh=fresh,
+    ))
+
+
+async def _remake_async(composer: 'AsyncUnholyCompose', scripts, *, fresh=False):
+    """
+    The docker parts of :func:`remake`.
+    """
+    import asyncio
+
     # Do initialization
-    if (c := unholy.compose.devenv_get()) is not None:
-        c.remove(force=True)
+    await asyncio.gather(composer.pull_images(), composer.devenv_delete())
 
-    with unholy.compose.bootstrap_spawn() as container:
+    async with composer.bootstrap_spawn() as container:
         # Compose usually fails because of container problems. We mostly care about networks and volumes.
-        unholy.compose.compose_run('up', '--detach', container=container, check=False)
+        await composer.compose_run('up', '--detach', container=container, check=False)
 
-    unholy.compose.devenv_create(
-        get_script_stack(project_name=name, project_config=unholy.unholyfile),
-    )
+    await composer.devenv_create(scripts, fresh=fresh)
+
+
+@main.command()
+@multi_project
+@format_exceptions
+def start(name):
+    """
+    Start the devenv and compose services.
+    """
+    unholy = get_bits(name)
+    devenv = unholy.compose.devenv_get()  # Starts it, if needed
+    if devenv is None:
+        raise click.ClickException(f"Project {name} has no devenv. Use `unholy remake` to make one.")
+    unholy.compose.compose_run('up', '--detach', check=False)
+
+
+@main.command()
+@multi_project
+@format_exceptions
+def stop(name):
+    """
+    Stop the compose services and the devenv.
+    """
+    from .compose import UnholyCompose
+
+    # Don't start the devenv just to read its Unholyfile
+    composer = UnholyCompose(name, get_config_stack(project_name=name))
+    if (devenv := composer.container_find(composer.DEVENV_SERVICE)) is None \
+            or devenv.status != 'running':
+        click.echo(f"Project {name} is not running")
+        return
+    unholy = get_bits(name)
+    unholy.compose.compose_run('stop', container=devenv, check=False)
+    devenv.stop()
+
+
+@main.command()
+@multi_project
+@format_exceptions
+def sync(name):
+    """
+    Copy changed config files (sync.paths) into the devenv.
+    """
+    unholy = get_bits(name)
+    devenv = unholy.compose.devenv_get()
+    if devenv is None:
+        raise click.ClickException(f"Project {name} has no devenv. Use `unholy remake` to make one.")
+    changed = unholy.compose.config_sync(devenv)
+    for path in changed:
+        click.echo(f"Updated ~/{path}")
+    click.echo(f"{len(changed)} file(s) updated")
 
 
 @main.command()
@@ -210,10 +356,36 @@ def shell(name):
 
 
 @main.command()
+@click.option('--status', '-s', is_flag=True, help="Also show the state of each project's devenv")
 @format_exceptions
-def ls():
+def ls(status):
     """
     List projects in the local config.
     """
-    for name in list_projects():
-        click.echo(name)
+    if not status:
+        for name in list_projects():
+            click.echo(name)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    from .compose import project_statuses
+
+    by_context = {}
+    for name, entry in sorted(project_index().items()):
+        by_context.setdefault(entry['context'], {})[name] = entry
+
+    def check(context):
+        try:
+            return project_statuses(context, by_context[context])
+        except Exception as exc:
+            # Unreachable daemons shouldn't hide the other contexts
+            return {name: f"unavailable: {exc}" for name in by_context[context]}
+
+    with ThreadPoolExecutor() as pool:
+        results = dict(zip(by_context, pool.map(check, by_context)))
+
+    width = max((len(name) for entries in by_context.values() for name in entries), default=0)
+    for context, statuses in results.items():
+        click.secho(context or 'default', bold=True)
+        for name, state in statuses.items():
+            click.echo(f"  {name:<{width}}  {state}")
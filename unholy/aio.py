@@ -0,0 +1,79 @@
+"""
+Asyncio interface to unholy's docker operations.
+
+docker-py is synchronous, so calls are made in worker threads. This lets
+independent steps overlap without blocking the event loop.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import functools
+from typing import AsyncIterator, Iterable
+
+import docker.models.containers
+import docker.models.images
+import docker.models.volumes
+
+from .compose import UnholyCompose
+
+
+class AsyncUnholyCompose:
+    """
+    Async wrapper around :class:`unholy.compose.UnholyCompose`.
+
+    Each method is the async version of the one with the same name.
+    """
+
+    def __init__(self, compose: UnholyCompose):
+        #: The wrapped (synchronous) compose
+        self.sync = compose
+
+    async def _call(self, method, *pargs, **kwargs):
+        return await asyncio.to_thread(
+            functools.partial(getattr(self.sync, method), *pargs, **kwargs)
+        )
+
+    @property
+    def WORKSPACE_MOUNTPOINT(self):
+        return self.sync.WORKSPACE_MOUNTPOINT
+
+    async def pull_images(self, *images: str):
+        await self._call('pull_images', *images)
+
+    async def pull(self, image: str) -> docker.models.images.Image:
+        return await self._call('pull', image)
+
+    async def workspace_get(self) -> None | docker.models.volumes.Volume:
+        return await self._call('workspace_get')
+
+    async def workspace_create(self) -> docker.models.volumes.Volume:
+        return await self._call('workspace_create')
+
+    async def workspace_delete(self):
+        await self._call('workspace_delete')
+
+    async def devenv_get(self) -> None | docker.models.containers.Container:
+        return await self._call('devenv_get')
+
+    async def devenv_delete(self):
+        await self._call('devenv_delete')
+
+    async def devenv_create(self, scripts: Iterable[str], **opts) -> docker.models.containers.Container:
+        return await self._call('devenv_create', scripts, **opts)
+
+    async def get_unholyfile(self) -> str:
+        return await self._call('get_unholyfile')
+
+    async def compose_run(self, *cmd, **opts):
+        return await self._call('compose_run', *cmd, **opts)
+
+    @asynccontextmanager
+    async def bootstrap_spawn(self, accessories=True) -> AsyncIterator[docker.models.containers.Container]:
+        cm = self.sync.bootstrap_spawn(accessories=accessories)
+        cont = await asyncio.to_thread(cm.__enter__)
+        try:
+            yield cont
+        except BaseException as exc:
+            if not await asyncio.to_thread(cm.__exit__, type(exc), exc, exc.__traceback__):
+                raise
+        else:
+            await asyncio.to_thread(cm.__exit__, None, None, None)
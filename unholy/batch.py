@@ -0,0 +1,129 @@
+"""
+Run commands over many projects at once.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import click
+
+from .config import project_index
+
+
+#: Colors to tell projects apart by
+_COLORS = ['cyan', 'magenta', 'yellow', 'blue', 'green', 'bright_cyan', 'bright_magenta', 'bright_yellow']
+
+
+@dataclasses.dataclass
+class BatchResult:
+    #: Project name
+    name: str
+    #: Docker context the project is in
+    context: str | None
+    #: Exit code of the command
+    returncode: int
+    #: How long it took, in seconds
+    duration: float
+
+
+def _unholy_cmd(*args: str) -> list[str]:
+    """
+    The command to run unholy again in a subprocess.
+    """
+    return [sys.executable, '-m', 'unholy', *args]
+
+
+def _unholy_env() -> dict[str, str]:
+    """
+    Environment so the subprocess finds this copy of unholy (even in a zipapp).
+    """
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [here, env.get('PYTHONPATH')]))
+    return env
+
+
+def run_batch(command: list[str], names: list[str], *, jobs: int) -> list[BatchResult]:
+    """
+    Runs ``unholy COMMAND NAME`` for every project.
+
+    Each Docker context gets its own pool of jobs workers, so a slow daemon
+    doesn't hold up the others. Output is prefixed with the project name.
+    """
+    index = project_index()
+    unknown = [name for name in names if name not in index]
+    if unknown:
+        raise click.BadParameter(f"Unknown projects: {', '.join(unknown)}", param_hint='NAME')
+
+    by_context = {}
+    for name in names:
+        by_context.setdefault(index[name]['context'], []).append(name)
+
+    width = max(len(name) for name in names)
+    colors = dict(zip(names, itertools.cycle(_COLORS)))
+    output_lock = threading.Lock()
+    env = _unholy_env()
+
+    def run(name) -> BatchResult:
+        prefix = click.style(f"{name:<{width}} |", fg=colors[name])
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            _unholy_cmd(*command, name),
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            env=env,
+        )
+        for line in proc.stdout:
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            with output_lock:
+                click.echo(f"{prefix} {line}")
+        proc.wait()
+        return BatchResult(
+            name=name, context=index[name]['context'],
+            returncode=proc.returncode, duration=time.monotonic() - start,
+        )
+
+    pools = [
+        (ThreadPoolExecutor(max_workers=jobs), members)
+        for members in by_context.values()
+    ]
+    futures = {}
+    for pool, members in pools:
+        for name in members:
+            futures[name] = pool.submit(run, name)
+    for pool, _ in pools:
+        pool.shutdown()
+
+    return [futures[name].result() for name in names]
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02}s"
+
+
+def print_summary(results: list[BatchResult]):
+    """
+    Print a table of how everything went.
+    """
+    rows = [
+        (
+            result.name, result.context or 'default',
+            _format_duration(result.duration),
+            'ok' if result.returncode == 0 else f'failed ({result.returncode})',
+        )
+        for result in results
+    ]
+    headers = ('project', 'context', 'time', 'result')
+    widths = [max(len(row[i]) for row in [headers, *rows]) for i in range(len(headers))]
+    click.echo("")
+    click.secho('  '.join(h.ljust(w) for h, w in zip(headers, widths)).rstrip(), bold=True)
+    for row, result in zip(rows, results):
+        click.secho(
+            '  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip(),
+            fg=None if result.returncode == 0 else 'red',
+        )
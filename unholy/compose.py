@@ -3,22 +3,27 @@ Utilities for working with docker compose.
 """
 from contextlib import contextmanager, ExitStack
 import enum
-import io
+import hashlib
+import itertools
+import json
 import os.path
 import pathlib
 import shlex
 import subprocess
-import tarfile
 import tempfile
-from typing import Iterable, Iterator
+import time
+from typing import Callable, Iterable, Iterator, Mapping, Self
 
 import docker
 import docker.errors
 import docker.models
-from unholy.junk_drawer import tarfile_add
+from unholy.junk_drawer import tar_blob, tar_path, tar_stream
 
-from .config import app_dirs
-from .docker import get_client, smart_pull, mount, inject_and_run, container_run, wait_for_status
+from .config import app_dirs, cache_path
+from .docker import (
+    get_client, pull_many, mount, inject_and_run_many, container_run,
+    wait_for_status, stat_path, socket_path, read_file,
+)
 
 
 class Label(enum.StrEnum):
@@ -57,6 +62,20 @@ class Label(enum.StrEnum):
     ContainerReplace = "com.docker.compose.replace"
 
 
+class UnholyLabel(enum.StrEnum):
+    """
+    Labels unholy uses for its own bookkeeping.
+    """
+    #: marks a bootstrap container that is kept around between commands
+    Warm = "io.github.astraluma.unholy.warm"
+    #: the provisioning hash of a devenv snapshot image
+    Snapshot = "io.github.astraluma.unholy.snapshot"
+    #: the project that made a devenv snapshot image
+    SnapshotProject = "io.github.astraluma.unholy.snapshot.project"
+    #: the name of a cache volume shared between projects
+    Cache = "io.github.astraluma.unholy.cache"
+
+
 class Compose:
     """
     Wrapper around a docker client that does all the extra compose bits.
@@ -73,20 +92,105 @@ class Compose:
 
         self.client = get_client(self.config.get('context', None))
 
-    def volume_list(self) -> Iterator[docker.models.volumes.Volume]:
+        #: Lookup results, keyed by resource kind and label filters.
+        #: See :meth:`_cached_list`.
+        self._resource_cache = {}
+
+    def with_config(self, unholy_config) -> Self:
+        """
+        Make a new instance with updated config.
+
+        Lookups are carried over if it still refers to the same project.
+        """
+        new = type(self)(self.name, unholy_config)
+        if new.client is self.client and new.project_name == self.project_name:
+            new._resource_cache = self._resource_cache
+        return new
+
+    #: How long (in seconds) lookup results may be reused
+    RESOURCE_CACHE_TTL = 10
+
+    def _cached_list(self, kind: str, labels: dict[str, str], fetch: Callable[[], Iterable]) -> list:
+        """
+        Look up resources through the cache.
+
+        If the whole project has been listed recently, that's filtered locally
+        instead of asking the daemon again.
+
+        Args:
+            kind: The resource kind, ``'container'`` or ``'volume'``
+            labels: The additional labels to filter by
+            fetch: Called to actually list the resources on a cache miss
+        """
+        now = time.monotonic()
+        key = (kind, frozenset(labels.items()))
+        broad = (kind, frozenset())
+        for k in (key, broad):
+            if k in self._resource_cache:
+                stamp, items = self._resource_cache[k]
+                if now - stamp > self.RESOURCE_CACHE_TTL:
+                    del self._resource_cache[k]
+                elif k == key:
+                    return items
+                else:
+                    return [
+                        item for item in items
+                        if all(_labels_of(item).get(lk) == lv for lk, lv in labels.items())
+                    ]
+
+        items = list(fetch())
+        self._resource_cache[key] = now, items
+        return items
+
+    def invalidate(self, kind: str | None = None):
+        """
+        Forget cached lookups, because something changed.
+
+        Args:
+            kind: The resource kind to forget, or all of them if None
+        """
+        if kind is None:
+            self._resource_cache.clear()
+        else:
+            for key in [k for k in self._resource_cache if k[0] == kind]:
+                del self._resource_cache[key]
+
+    def _label_filters(self, labels: dict[str, str]) -> dict[str, list[str]]:
+        """
+        Build the API filters to select project resources with the given labels.
+
+        The filtering is done by the daemon, so only matching resources are sent
+        back to us.
+        """
+        labels = {Label.Project: self.project_name} | labels
+        return {
+            'label': [f"{k}={v}" for k, v in labels.items()],
+        }
+
+    def volume_list(self, **labels: str) -> Iterator[docker.models.volumes.Volume]:
         """
         Enumerate realized volumes associated with this project.
+
+        Args:
+            labels: Additional labels the volumes must have
         """
-        for vol in self.client.volumes.list():
-            if vol.attrs['Labels'] and \
-                    vol.attrs['Labels'].get(Label.Project) == self.project_name:
-                yield vol
+        yield from self._cached_list(
+            'volume', labels,
+            lambda: self.client.volumes.list(filters=self._label_filters(labels)),
+        )
+
+    def volume_find(self, name) -> None | docker.models.volumes.Volume:
+        """
+        Find the volume in the project with the given compose name, or None.
+        """
+        return next(self.volume_list(**{Label.Volume: name}), None)
 
     def volume_create(self, name, *, labels=None) -> docker.models.volumes.Volume:
         """
         Create a volume in the compose project
         """
         labels = labels or {}
+        self.invalidate('volume')
         return self.client.volumes.create(
             name=f"{self.project_name}_{name}",
             labels={
@@ -95,6 +199,26 @@ class Compose:
             } | labels,
         )
 
+    def network_find(self, name) -> None | docker.models.networks.Network:
+        """
+        Find the network in the project with the given compose name, or None.
+        """
+        return next(iter(self.client.networks.list(
+            filters=self._label_filters({Label.Network: name}),
+        )), None)
+
+    def network_create(self, name) -> docker.models.networks.Network:
+        """
+        Create a network in the compose project
+        """
+        return self.client.networks.create(
+            name=f"{self.project_name}_{name}",
+            labels={
+                Label.Project: self.project_name,
+                Label.Network: name,
+            },
+        )
+
     def _socket_mount_opts(self):
         """
         Get the options needed for a container to access the docker socket.
@@ -114,13 +238,25 @@ class Compose:
             # 'privledged': True,
         }
 
-    def container_list(self) -> Iterator[docker.models.containers.Container]:
+    def container_list(self, **labels: str) -> Iterator[docker.models.containers.Container]:
         """
         Enumerate realized containers associated with this project.
+
+        Args:
+            labels: Additional labels the containers must have
+        """
+        yield from self._cached_list(
+            'container', labels,
+            lambda: self.client.containers.list(
+                all=True, filters=self._label_filters(labels),
+            ),
+        )
+
+    def container_find(self, service) -> None | docker.models.containers.Container:
+        """
+        Find a container for the given service, or None.
         """
-        for con in self.client.containers.list(all=True):
-            if con.labels.get(Label.Project) == self.project_name:
-                yield con
+        return next(self.container_list(**{Label.Service: service}), None)
 
     def container_create(
         self, service, image, *,
@@ -149,6 +285,7 @@ class Compose:
             mounts += socket_bits.pop('mounts', [])
             opts |= socket_bits
 
+        self.invalidate('container')
         return self.client.containers.create(
             name=f"{self.project_name}-{service}-1",
             image=image,
@@ -202,20 +339,81 @@ class UnholyCompose(Compose):
     #   a devenv might not be available
 
     BOOTSTRAP_IMAGE = 'ghcr.io/astraluma/unholy/bootstrap:trunk'
+    BOOTSTRAP_SERVICE = 'bootstrap'
+    #: File touched whenever a warm bootstrap container is used
+    BOOTSTRAP_STAMP = '/run/unholy-last-used'
     WORKSPACE_MOUNTPOINT = '/workspace'
     DEVENV_SERVICE = 'devenv'
+    #: Local image repository for provisioned devenv snapshots
+    SNAPSHOT_REPOSITORY = 'unholy-snapshot'
+    #: Prefix of the names of shared cache volumes
+    CACHE_VOLUME_PREFIX = 'unholy-cache-'
+    PROXY_SERVICE = 'proxy'
+    PROXY_PORT = 3128
+    #: The network the proxy and devenv share
+    PROXY_NETWORK = 'unholy'
+    #: The volume the proxy keeps its cache in
+    PROXY_VOLUME = 'proxy-cache'
 
     def __init__(self, *p, **kw):
         super().__init__(*p, **kw)
         self.workspace_name = self.config.get('dev', {}).get('volume')
+        #: Images already pulled by :meth:`pull_images`
+        self._pulled_images = {}
+        #: Cache volumes already looked up by :meth:`cache_volumes`
+        self._cache_volumes = None
+
+    def cache_volumes(self) -> dict[str, docker.models.volumes.Volume]:
+        """
+        Get the shared cache volumes (``cache.volumes``), creating any missing.
+
+        These belong to the docker context instead of a project, so every
+        project on it shares them.
+
+        Returns:
+            The volumes, by mountpoint
+        """
+        if self._cache_volumes is None:
+            cache = self.config.get('cache', {})
+            self._cache_volumes = {}
+            if cache.get('enabled', False):
+                for name, mountpoint in cache.get('volumes', {}).items():
+                    if not mountpoint:
+                        continue
+                    # Creating a volume that already exists just returns it
+                    self._cache_volumes[mountpoint] = self.client.volumes.create(
+                        name=f"{self.CACHE_VOLUME_PREFIX}{name}",
+                        labels={UnholyLabel.Cache: name},
+                    )
+        return self._cache_volumes
+
+    def container_create(
+        self, service, image, *,
+        mount_caches=False, environment=None, mounts=None,
+        **opts
+    ):
+        """
+        :meth:`Compose.container_create`, and optionally mount the shared
+        cache volumes.
+
+        The generic download cache (``cache.volumes.downloads``) is given to
+        scripts as ``$UNHOLY_CACHE``.
+        """
+        if mount_caches and (volumes := self.cache_volumes()):
+            mounts = [*(mounts or []), *(
+                mount(mountpoint, vol) for mountpoint, vol in volumes.items()
+            )]
+            if downloads := self.config['cache']['volumes'].get('downloads'):
+                environment = (environment or {}) | {'UNHOLY_CACHE': downloads}
+        return super().container_create(
+            service, image, environment=environment, mounts=mounts, **opts
+        )
 
     def workspace_get(self) -> None | docker.models.volumes.Volume:
         """
         Searches for the workspace, or returns None
         """
-        for vol in self.volume_list():
-            if vol.attrs['Labels'].get(Label.Volume) == self.workspace_name:
-                return vol
+        return self.volume_find(self.workspace_name)
 
     def workspace_create(self) -> docker.models.volumes.Volume:
         """
@@ -230,51 +428,156 @@ class UnholyCompose(Compose):
         """
         vol = self.workspace_get()
         if vol is not None:
+            # A warm bootstrap would keep the volume in use
+            if (cont := self.container_find(self.BOOTSTRAP_SERVICE)) is not None:
+                cont.remove(force=True)
+                self.invalidate('container')
             vol.remove()
+            self.invalidate('volume')
 
-    def _inject_config(self, cont: docker.models.containers.Container):
+    #: Where the record of synced files is kept, relative to the container home
+    SYNC_MANIFEST = '.unholy-sync.json'
+
+    def _config_files(self) -> dict[str, pathlib.Path]:
         """
-        Copy some specific user config files to the container
+        The user config files to copy into containers (``sync.paths``).
+
+        Maps paths relative to home to the local files. Directories are
+        expanded into the files they contain.
         """
         real_home = pathlib.Path.home()
+        files = {}
+        for pattern in self.config.get('sync', {}).get('paths', []):
+            for path in sorted(real_home.glob(pattern)):
+                if path.is_dir():
+                    found = sorted(p for p in path.rglob('*') if p.is_file())
+                elif path.is_file():
+                    found = [path]
+                else:
+                    found = []
+                for file in found:
+                    files[file.relative_to(real_home).as_posix()] = file
+        return files
+
+    def config_sync(self, cont: docker.models.containers.Container) -> list[str]:
+        """
+        Copy the user's config files (``sync.paths``) to the container.
+
+        A manifest of what was copied is kept in the container, and only
+        files that changed since are sent, all in one upload.
+
+        Returns:
+            The paths (relative to home) that were updated
+        """
         cont_home = container_run(
             cont, ['/bin/sh', '-c', 'echo ~'],
             stdout=subprocess.PIPE, encoding='utf-8',
         ).stdout.strip()
+        try:
+            manifest = json.loads(read_file(cont, f"{cont_home}/{self.SYNC_MANIFEST}")[0])
+        except (FileNotFoundError, ValueError):
+            manifest = {}
 
-        files_to_try = [
-            real_home / '.gitconfig',
-            real_home / '.ssh' / 'known_hosts',
-            *(real_home / '.ssh').glob('*.pub'),
-            # real_home / '.ssh' / 'config',  # XXX: Include this?
-        ]
-
-        buf = io.BytesIO()
-        with tarfile.open(fileobj=buf, mode='w:') as tf:
-            for file in files_to_try:
-                if file.exists():
-                    st = file.stat()
-                    tarfile_add(
-                        tf, str(file.relative_to(real_home)), file.read_bytes(),
-                        mode=st.st_mode,
-                    )
+        files = self._config_files()
+        new_manifest = {}
+        changed = []
+        for name, file in files.items():
+            st = file.stat()
+            entry = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+            old = manifest.get(name)
+            if old is not None and old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+                new_manifest[name] = old
+                continue
+            with file.open('rb') as f:
+                entry['sha256'] = hashlib.file_digest(f, 'sha256').hexdigest()
+            new_manifest[name] = entry
+            # A touched but identical file doesn't need to go over
+            if old is None or old.get('sha256') != entry['sha256']:
+                changed.append(name)
+        # Files dropped locally are left alone in the container
 
-        buf.seek(0)
-        cont.put_archive(cont_home, buf)
+        if changed or new_manifest != manifest:
+            cont.put_archive(cont_home, tar_stream(itertools.chain(
+                *(
+                    tar_path(name, files[name], follow_symlinks=True)
+                    for name in changed
+                ),
+                tar_blob(self.SYNC_MANIFEST, json.dumps(new_manifest), mode=0o600),
+            )))
+        return changed
 
     @contextmanager
     def bootstrap_spawn(self, accessories=True) -> docker.models.containers.Container:
         """
         Start a bootstrap container and clean it up when done.
 
+        If ``bootstrap.keep_warm`` is set, an idle container is reused (or left
+        behind for next time) instead.
+
         Args:
             accessories: Whether to include config blobs, ssh agent, and other bits
         """
-        img = smart_pull(self.client, self.BOOTSTRAP_IMAGE)
+        bootstrap_config = self.config.get('bootstrap', {})
+        # A warm container hanging around is reused, even if this config
+        # doesn't ask for one. (It also has the name we'd use.)
+        cont = self._bootstrap_existing()
+        if cont is None and bootstrap_config.get('keep_warm', False):
+            cont = self._bootstrap_warm(bootstrap_config.get('idle_timeout', 600))
+        elif cont is not None and accessories:
+            # Things may have changed since it was made
+            self.config_sync(cont)
+            self.ensure_agent_forward(cont)
+        if cont is not None:
+            yield cont
+            # Only on success: after a failure, the container may well be gone,
+            # and that error shouldn't hide the real one
+            container_run(cont, ['touch', self.BOOTSTRAP_STAMP], check=True)
+            return
+
+        cont = self._bootstrap_create(accessories=accessories)
+        try:
+            yield cont
+        finally:
+            cont.stop()
+            try:
+                cont.remove()
+            except docker.errors.APIError:
+                # This usually happens, because auto_remove
+                pass
+            self.invalidate('container')
+
+    def pull_images(self, *images: str):
+        """
+        Pull several images at once, ahead of when they're needed.
+
+        Defaults to both the bootstrap and devenv images.
+        """
+        if not images:
+            images = [self.BOOTSTRAP_IMAGE, self.config['dev']['image']]
+        dev_config = self.config.get('dev', {})
+        self._pulled_images |= pull_many(
+            self.client, images,
+            policy=dev_config.get('pull', 'always'),
+            max_age=dev_config.get('pull_max_age'),
+        )
+
+    def pull(self, image: str) -> docker.models.images.Image:
+        """
+        Pull an image, according to the configured pull policy.
+        """
+        if image not in self._pulled_images:
+            self.pull_images(image)
+        return self._pulled_images[image]
+
+    def _bootstrap_create(self, *, accessories, **opts) -> docker.models.containers.Container:
+        """
+        Create and start a bootstrap container.
+        """
+        img = self.pull(self.BOOTSTRAP_IMAGE)
         proj = self.workspace_get()
         assert proj is not None
         cont = self.container_create(
-            'bootstrap', img,
+            self.BOOTSTRAP_SERVICE, img,
             one_off=True,
             init=True,
             auto_remove=True,
@@ -283,102 +586,385 @@ class UnholyCompose(Compose):
             ],
             working_dir=self.WORKSPACE_MOUNTPOINT,
             mount_docker_socket=accessories,
+            mount_caches=True,
             environment={
                 'SSH_AUTH_SOCK': self.agent_path(),
             },
+            **opts
         )
         print("Starting")
         cont.start()
         if accessories:
-            self._inject_config(cont)
+            self.config_sync(cont)
             wait_for_status(cont, 'running')
             self.ensure_agent_forward(cont)
-        try:
-            yield cont
-        finally:
-            cont.stop()
+        return cont
+
+    def _bootstrap_existing(self) -> None | docker.models.containers.Container:
+        """
+        Get the warm bootstrap container, if there's a usable one.
+
+        Any other bootstrap container (stale, or left over from a crash) is
+        removed, since it would be in the way of making a new one.
+        """
+        proj = self.workspace_get()
+        assert proj is not None
+        cont = self.container_find(self.BOOTSTRAP_SERVICE)
+        if cont is None:
+            return None
+        if cont.status == 'running' and cont.labels.get(UnholyLabel.Warm) \
+                and any(m.get('Name') == proj.name for m in cont.attrs['Mounts']):
             try:
-                cont.remove()
-            except docker.errors.APIError:
-                # This usually happens, because auto_remove
+                # Also makes sure it isn't in the middle of reaping itself
+                container_run(cont, ['touch', self.BOOTSTRAP_STAMP], check=True)
+            except (docker.errors.APIError, subprocess.CalledProcessError):
                 pass
+            else:
+                return cont
+        try:
+            cont.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        self.invalidate('container')
+        return None
+
+    def _bootstrap_warm(self, idle_timeout: int) -> docker.models.containers.Container:
+        """
+        Start a warm bootstrap container.
+
+        The container reaps itself once it's been idle for idle_timeout
+        seconds, so nothing has to be running on our side. Check for an
+        existing one with :meth:`_bootstrap_existing` first.
+        """
+        stamp = shlex.quote(self.BOOTSTRAP_STAMP)
+        return self._bootstrap_create(
+            accessories=True,
+            labels={UnholyLabel.Warm: 'True'},
+            command=[
+                '/bin/sh', '-c',
+                f'touch {stamp}; '
+                f'while [ $(( $(date +%s) - $(stat -c %Y {stamp}) )) -lt {int(idle_timeout)} ]; '
+                'do sleep 10; done',
+            ],
+        )
+
+    def _proxy_conf(self) -> str:
+        """
+        The squid config for the proxy, added to the image's own.
+        """
+        size = self.config['proxy'].get('cache_size', 4096)
+        return "\n".join([
+            "# Written by unholy",
+            # Only reachable from the project network, but the image default
+            # only allows localhost
+            "acl unholy_net src 10.0.0.0/8 172.16.0.0/12 192.168.0.0/16",
+            "http_access allow unholy_net",
+            f"cache_dir ufs /var/spool/squid {size} 16 256",
+            "maximum_object_size 1 GB",
+            # Packages and release artifacts don't change under the same name,
+            # so keep them for a while, but still revalidate with the server
+            r"refresh_pattern -i \.(deb|udeb|whl|tar\.gz|tgz|tar\.xz|zip|gpg|asc)$ 1440 100% 43200 refresh-ims",
+            "",
+        ])
+
+    def proxy_start(self) -> None | str:
+        """
+        Start the caching proxy (``proxy.enabled``), creating it if needed.
+
+        Returns:
+            The proxy URL, or None if it's disabled
+        """
+        if not self.config.get('proxy', {}).get('enabled', False):
+            return None
+        net = self.network_find(self.PROXY_NETWORK) or self.network_create(self.PROXY_NETWORK)
+        if (cont := self.container_find(self.PROXY_SERVICE)) is None:
+            vol = self.volume_find(self.PROXY_VOLUME) or self.volume_create(self.PROXY_VOLUME)
+            cont = self.container_create(
+                self.PROXY_SERVICE, self.pull(self.config['proxy']['image']),
+                mounts=[
+                    mount('/var/spool/squid', vol),
+                ],
+                network=net.name,
+            )
+        if cont.status != 'running':
+            # Rewritten each time, so config changes take effect
+            cont.put_archive('/etc/squid/conf.d', tar_stream(
+                tar_blob('unholy.conf', self._proxy_conf(), mode=0o644)
+            ))
+            cont.start()
+            # Running isn't listening yet; wait for squid to come up
+            wait_for_status(cont, 'running')
+            for delay in (0.1, 0.2, 0.5, 1, 2, 5, 10):
+                if container_run(cont, ['squid', '-k', 'check']).returncode == 0:
+                    break
+                time.sleep(delay)
+            else:
+                raise RuntimeError("Proxy did not start")
+        return f"http://{cont.name}:{self.PROXY_PORT}"
+
+    def proxy_stop(self):
+        """
+        Stop the caching proxy, if it's running.
+        """
+        if (cont := self.container_find(self.PROXY_SERVICE)) is not None and cont.status == 'running':
+            cont.stop()
+            self.invalidate('container')
 
     def devenv_get(self) -> None | docker.models.containers.Container:
         """
         Get the devenv container, if it exists.
         """
-        for con in self.container_list():
-            if con.labels.get(Label.Service) == self.DEVENV_SERVICE:
-                if not con.status != 'running':
-                    con.start()
-                return con
+        con = self.container_find(self.DEVENV_SERVICE)
+        if con is not None and con.status != 'running':
+            con.start()
+            # Keep the cached object current
+            con.reload()
+        return con
+
+    def devenv_delete(self):
+        """
+        Deletes the devenv container, if it exists.
+        """
+        con = self.container_find(self.DEVENV_SERVICE)
+        if con is not None:
+            con.remove(force=True)
+            self.invalidate('container')
+
+    def _snapshot_keys(self, base: docker.models.images.Image, scripts: list[str]) -> list[str]:
+        """
+        Hash everything that goes into provisioning a devenv, layer by layer.
+
+        The first key covers the base image, and each following key adds the
+        next script. Each key covers everything before it, so a key names
+        exactly one provisioning state. (Synced config isn't included; it's
+        brought up to date after the snapshot is started.)
+        """
+        h = hashlib.sha256()
+
+        def add(blob: bytes):
+            # Length-prefix so that the boundaries between blobs count
+            h.update(len(blob).to_bytes(8, 'big'))
+            h.update(blob)
+
+        add(base.id.encode('utf-8'))
+        keys = [h.hexdigest()]
+        for script in scripts:
+            add(script.encode('utf-8'))
+            keys.append(h.hexdigest())
+        return keys
+
+    def snapshot_get(self, key: str) -> None | docker.models.images.Image:
+        """
+        Get the devenv snapshot with the given provisioning hash, or None.
+        """
+        try:
+            return self.client.images.get(f"{self.SNAPSHOT_REPOSITORY}:{key}")
+        except docker.errors.ImageNotFound:
+            return None
 
-    def devenv_create(self, scripts: Iterable[str]):
+    def snapshot_prune(self, keep: Iterable[str]):
+        """
+        Remove the project's devenv snapshots, other than the given ones.
+
+        Snapshots still used by a container (eg, another project's devenv) are
+        left alone.
+        """
+        keep = set(keep)
+        for image in self.client.images.list(filters={'label': [
+            UnholyLabel.Snapshot, f"{UnholyLabel.SnapshotProject}={self.project_name}",
+        ]}):
+            key = image.labels[UnholyLabel.Snapshot]
+            if key in keep:
+                continue
+            try:
+                self.client.images.remove(f"{self.SNAPSHOT_REPOSITORY}:{key}")
+            except docker.errors.APIError:
+                pass
+
+    def devenv_create(self, scripts: Iterable[str], *, fresh: bool = False):
         """
         Create the devenv container.
 
+        If ``dev.snapshot`` is enabled, the container is saved as an image
+        after each script, tagged with a hash of the base image and scripts so
+        far. (Synced config isn't part of it.) Later, provisioning resumes from
+        the deepest snapshot that still matches, and only the scripts after it
+        are run. Once provisioned, the project's other snapshots are removed.
+
         Args:
             scripts: The list of configuration scripts to run.
+            fresh: Provision from scratch, even if there's a snapshot
         """
-        img = smart_pull(self.client, self.config['dev']['image'])
+        img = self.pull(self.config['dev']['image'])
         proj = self.workspace_get()
         assert proj is not None
-        cont = self.container_create(
-            self.DEVENV_SERVICE, img,
-            command=['sleep', 'infinity'],
-            hostname=self.name,  # FIXME: read from config
-            init=True,
-            mounts=[
-                mount(self.WORKSPACE_MOUNTPOINT, proj),
-                # TODO: Other mounts
-            ],
-            tmpfs={
-                '/tmp': '',
-            },
-            working_dir=self.WORKSPACE_MOUNTPOINT,
-            mount_docker_socket=True,
-            environment={
-                'SSH_AUTH_SOCK': self.agent_path(),
-            },
-            # TODO: Networks
-        )
-        cont.start()
-        self._inject_config(cont)
-        for i, script in enumerate(scripts):
-            if script:
-                inject_and_run(
-                    cont, fix_script(script),
-                    cwd=self.WORKSPACE_MOUNTPOINT,
-                    name=f'unholyscript-{i}'
-                )
+
+        scripts = [fix_script(script) for script in scripts if script]
+        use_snapshots = self.config['dev'].get('snapshot', False)
+        keys = self._snapshot_keys(img, scripts)
+        # How many scripts are already applied, and the image with them
+        done, snapshot = 0, None
+        if use_snapshots and not fresh:
+            for depth in reversed(range(1, len(keys))):
+                if (snapshot := self.snapshot_get(keys[depth])) is not None:
+                    done = depth
+                    break
+
+        remaining = [
+            (f'unholyscript-{i}', script)
+            for i, script in enumerate(scripts)
+        ][done:]
+        # Only the scripts go through the proxy, so the devenv keeps working
+        # when it's not running. Started first, so a proxy that won't start
+        # doesn't leave a half-made devenv.
+        proxy = self.proxy_start() if remaining else None
+        results = []
+        try:
+            cont = self.container_create(
+                self.DEVENV_SERVICE, snapshot or img,
+                command=['sleep', 'infinity'],
+                hostname=self.name,  # FIXME: read from config
+                init=True,
+                mounts=[
+                    mount(self.WORKSPACE_MOUNTPOINT, proj),
+                    # TODO: Other mounts
+                ],
+                tmpfs={
+                    '/tmp': '',
+                },
+                working_dir=self.WORKSPACE_MOUNTPOINT,
+                mount_docker_socket=True,
+                mount_caches=True,
+                environment={
+                    'SSH_AUTH_SOCK': self.agent_path(),
+                },
+                # TODO: Networks
+            )
+            env = None
+            if proxy is not None:
+                self.network_find(self.PROXY_NETWORK).connect(cont)
+                env = {
+                    var: proxy
+                    for var in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY')
+                } | {'no_proxy': 'localhost,127.0.0.1', 'NO_PROXY': 'localhost,127.0.0.1'}
+            cont.start()
+            if snapshot is not None:
+                print(f"Using provisioned snapshot ({done} of {len(scripts)} scripts)")
+            # Snapshots carry the sync manifest, so this only sends what changed
+            self.config_sync(cont)
+
+            if not use_snapshots:
+                results += inject_and_run_many(cont, remaining, cwd=self.WORKSPACE_MOUNTPOINT, env=env)
+            else:
+                # One at a time, so there's somewhere to resume from. This costs
+                # an upload, exec, and commit per script, which is why
+                # snapshots are opt-in.
+                for depth, script in enumerate(remaining, start=done + 1):
+                    results += inject_and_run_many(cont, [script], cwd=self.WORKSPACE_MOUNTPOINT, env=env)
+                    cont.commit(
+                        repository=self.SNAPSHOT_REPOSITORY, tag=keys[depth],
+                        conf={'Labels': {
+                            UnholyLabel.Snapshot: keys[depth],
+                            UnholyLabel.SnapshotProject: self.project_name,
+                        }},
+                    )
+        finally:
+            if proxy is not None:
+                self.proxy_stop()
+        if use_snapshots:
+            # Superseded by the ones just made
+            self.snapshot_prune(keys)
+        if results:
+            # Each was already reported as it finished
+            print(f"Ran {len(results)} script(s) in {sum(r.duration for r in results)}s")
         return cont
 
+    def _unholyfile_cache_path(self) -> pathlib.Path:
+        """
+        Where the cached copy of the workspace Unholyfile lives.
+        """
+        key = hashlib.sha256(json.dumps([
+            self.config.get('context'), self.project_name, self.workspace_name,
+        ]).encode('utf-8')).hexdigest()
+        path = cache_path() / 'unholyfiles'
+        path.mkdir(exist_ok=True)
+        return path / f"{key}.json"
+
+    def _read_workspace_direct(self, name: str) -> None | str:
+        """
+        Read a file straight out of the workspace volume on disk.
+
+        Only possible if the daemon is local and we can get at its volumes.
+        Returns None if not.
+
+        Raises:
+            FileNotFoundError: The volume is readable, but the file isn't there
+        """
+        if socket_path(self.client) is None:
+            return None
+        vol = self.workspace_get()
+        if vol is None or not vol.attrs.get('Mountpoint'):
+            return None
+        mountpoint = pathlib.Path(vol.attrs['Mountpoint'])
+        try:
+            if not mountpoint.is_dir():
+                # eg, the daemon is in a VM
+                return None
+            return (mountpoint / name).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # Probably owned by root
+            return None
+
     def get_unholyfile(self) -> str:
         """
         Gets the config file from the workspace.
+
+        If the daemon is local, it's read directly from the volume.
+
+        Otherwise, a copy is kept locally. If the devenv is around, it's used
+        to check that the copy is still fresh, which is cheaper than
+        transferring it.
         """
+        try:
+            if (contents := self._read_workspace_direct('Unholyfile')) is not None:
+                return contents
+        except FileNotFoundError as exc:
+            raise FileNotFoundError("Unholyfile not in workspace") from exc
+
+        path = f'{self.WORKSPACE_MOUNTPOINT}/Unholyfile'
+        cachefile = self._unholyfile_cache_path()
+        try:
+            cached = json.loads(cachefile.read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            cached = None
+
         with ExitStack() as stack:
             if (cont := self.devenv_get()) is not None:
-                pass
+                try:
+                    stat = stat_path(cont, path)
+                except docker.errors.NotFound as exc:
+                    cachefile.unlink(missing_ok=True)
+                    raise FileNotFoundError("Unholyfile not in workspace") from exc
+                if cached is not None and \
+                        [cached['mtime'], cached['size']] == [stat['mtime'], stat['size']]:
+                    return cached['contents']
             else:
                 cont = stack.enter_context(self.bootstrap_spawn(accessories=False))
 
             try:
-                tarblob, _ = cont.get_archive(f'{self.WORKSPACE_MOUNTPOINT}/Unholyfile')
-            except docker.errors.NotFound as exc:
+                blob, stat = read_file(cont, path)
+            except FileNotFoundError as exc:
+                cachefile.unlink(missing_ok=True)
                 raise FileNotFoundError("Unholyfile not in workspace") from exc
-            buffer = io.BytesIO()
-            for bit in tarblob:
-                buffer.write(bit)
-            buffer.seek(0)
-            with tarfile.open(fileobj=buffer, mode='r|') as tf:
-                for member in tf:
-                    name = os.path.basename(member.name)
-                    if name == 'Unholyfile':
-                        assert member.isfile()
-                        return tf.extractfile(member).read().decode('utf-8')
-
-        raise RuntimeError("Unable to find Unholyfile in workspace.")
+            contents = blob.decode('utf-8')
+            cachefile.write_text(json.dumps({
+                'mtime': stat['mtime'],
+                'size': stat['size'],
+                'contents': contents,
+            }), encoding='utf-8')
+            return contents
 
     def compose_cmd(self, *cmd) -> list[str]:
         """
@@ -452,6 +1038,56 @@ class UnholyCompose(Compose):
         )
 
 
+def project_statuses(context: str | None, projects: Mapping[str, Mapping]) -> dict[str, str]:
+    """
+    Get the status of several projects in one Docker context.
+
+    This asks the daemon once for devenvs and once for workspaces, no matter
+    how many projects there are.
+
+    Args:
+        context: The Docker context
+        projects: Project names mapped to their :func:`unholy.config.project_index` entries
+
+    Returns:
+        Project names mapped to the devenv's status (``running``, ``exited``,
+        etc), ``no devenv``, or ``no workspace``
+    """
+    client = get_client(context)
+    devenvs = {
+        con['Labels'][Label.Project]: con['State']
+        for con in client.api.containers(all=True, filters={
+            'label': [Label.Project, f"{Label.Service}={UnholyCompose.DEVENV_SERVICE}"],
+        })
+    }
+    workspaces = {
+        (vol['Labels'][Label.Project], vol['Labels'][Label.Volume])
+        for vol in client.api.volumes(filters={
+            'label': [Label.Project, Label.Volume],
+        })['Volumes'] or []
+    }
+
+    statuses = {}
+    for name, entry in projects.items():
+        if entry['project'] in devenvs:
+            statuses[name] = devenvs[entry['project']]
+        elif (entry['project'], entry['volume']) in workspaces:
+            statuses[name] = 'no devenv'
+        else:
+            statuses[name] = 'no workspace'
+    return statuses
+
+
+def _labels_of(resource) -> dict[str, str]:
+    """
+    Get the labels of a container or volume.
+    """
+    if isinstance(resource, docker.models.volumes.Volume):
+        return resource.attrs['Labels'] or {}
+    else:
+        return resource.labels
+
+
 def fix_script(script: str) -> str:
     if not script.startswith('#!'):
         script = '#!/bin/sh\n' + script
@@ -1,25 +1,30 @@
 """
 Handle Unholyfile parsing
 """
-import collections
 from collections.abc import Mapping, MutableMapping
 import contextlib
+import dataclasses
 import functools
 import importlib.resources
 import io
+import json
 import os
 import pathlib
 import re
-from typing import Iterable, Iterator
+from typing import Iterable, Iterator, TYPE_CHECKING
 
 import appdirs
-import tomlkit
+
+# tomlkit is only imported when something is actually parsed
+if TYPE_CHECKING:
+    import tomlkit
 
 
 def parse(text) -> tuple[MutableMapping, str]:
     """
     Given a text blob, pull out the head matter and parse it.
     """
+    import tomlkit
     _, head, _, tail = _split_headmatter(text)
     head = tomlkit.parse(head)
     return head, tail
@@ -67,13 +72,15 @@ def _split_headmatter(text):
 
 
 @contextlib.contextmanager
-def edit_config(path: str | os.PathLike, *, create: bool = True) -> Iterator[tomlkit.TOMLDocument]:
+def edit_config(path: str | os.PathLike, *, create: bool = True) -> Iterator['tomlkit.TOMLDocument']:
     """
     Edit a config file in-place while preserving formatting.
 
     Context manager that yields a dict-like (technically,
     tomlkit.TOMLDocument).
     """
+    import tomlkit
+
     try:
         f = open(path, 'r+t', encoding='utf-8')
     except FileNotFoundError:
@@ -117,6 +124,17 @@ def config_path() -> pathlib.Path:
     return path
 
 
+@functools.cache
+def cache_path() -> pathlib.Path:
+    """
+    user_cache_dir but Path
+    """
+    path = pathlib.Path(app_dirs().user_cache_dir)
+    if not path.exists():
+        path.mkdir(parents=True)
+    return path
+
+
 def project_config_path(name: str) -> pathlib.Path:
     """
     Get the path for local project config
@@ -140,53 +158,125 @@ def list_projects() -> Iterable[str]:
         yield path.stem
 
 
-class ConfigStack(collections.ChainMap):
+class ConfigStack(Mapping):
+    """
+    Read-only view of several configs layered together, front first.
+
+    Tables are merged with the same tables further back; anything else is
+    taken from the front-most config that has it. This is all worked out
+    once, up front, so lookups are plain dict lookups.
+    """
+
+    def __init__(self, *maps: Mapping):
+        self._data = {}
+        for key in dict.fromkeys(key for inner in maps for key in inner):
+            values = [inner[key] for inner in maps if key in inner]
+            if isinstance(values[0], Mapping):
+                self._data[key] = type(self)(*(
+                    value for value in values if isinstance(value, Mapping)
+                ))
+            else:
+                self._data[key] = values[0]
+
     def __getitem__(self, key):
-        value = super().__getitem__(key)
-        if isinstance(value, dict):
-            return type(self)(*(
-                inner[key]
-                for inner in self.maps
-                if key in inner
-            ))
-        else:
-            return value
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._data!r})"
+
+
+@dataclasses.dataclass(frozen=True)
+class UnholyStack:
+    """
+    The config and scripts of a stack of Unholyfiles.
+    """
+    #: The merged configuration
+    config: ConfigStack
+    #: The scripts, back (core) to front (repo)
+    scripts: list[str]
+
+
+def _parse_plain(text: str) -> tuple[Mapping, str]:
+    """
+    :func:`parse`, but with the head matter as plain Python objects.
+    """
+    head, tail = parse(text)
+    return head.unwrap(), tail
+
+
+# Parsed files are shared between calls, so they must not be modified.
+_parse_text = functools.lru_cache(maxsize=32)(_parse_plain)
+
+
+@functools.cache
+def _parse_core() -> tuple[Mapping, str]:
+    """
+    Parse the Unholyfile built into unholy.
+    """
+    return _parse_plain(
+        importlib.resources.files('unholy')
+        .joinpath('core.Unholyfile').read_text(encoding='utf-8')
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_file_at(path: pathlib.Path, mtime_ns: int, size: int) -> tuple[Mapping, str]:
+    return _parse_plain(path.read_text(encoding='utf-8'))
 
 
-def _get_file_stack(*, project_name=None, project_config=None) -> Iterable[tuple[MutableMapping, str]]:
+def _parse_file(path: pathlib.Path) -> None | tuple[Mapping, str]:
+    """
+    Parse the Unholyfile at the given path, or return None if there isn't one.
+
+    Only parses again if the file changed.
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return _parse_file_at(path, st.st_mtime_ns, st.st_size)
+
+
+def _get_file_stack(*, project_name=None, project_config=None) -> Iterable[tuple[Mapping, str]]:
     """
     Get the complete Unholyfile stack
 
     Starts at the back (core) and works forward (project)
     """
     # Unholy core
-    yield parse(
-        importlib.resources.files('unholy')
-        .joinpath('core.Unholyfile').open('r', encoding='utf-8').read()
-    )
+    yield _parse_core()
 
     # User config
-    conf = config_path() / 'Unholyfile'
-    if conf.exists():
-        yield parse(conf.read_text(encoding='utf-8'))
+    if (parsed := _parse_file(config_path() / 'Unholyfile')) is not None:
+        yield parsed
 
     # Project config
     if project_name:
-        conf = project_config_path(project_name)
-        if conf.exists():
-            yield parse(conf.read_text(encoding='utf-8'))
+        if (parsed := _parse_file(project_config_path(project_name))) is not None:
+            yield parsed
 
     # Repo file
     if project_config and isinstance(project_config, str):
-        yield parse(project_config)
+        yield _parse_text(project_config)
 
 
-def get_config_stack(*, project_name=None, project_config=None) -> Mapping:
+def get_stack(*, project_name=None, project_config=None) -> UnholyStack:
     """
-    Get the complete configuration stack up for a given project.
+    Get the complete configuration and script stack for a given project.
 
     Also applies defaults.
     """
+    files = list(_get_file_stack(
+        project_name=project_name,
+        project_config=project_config,
+    ))
+
     defaults = {
         'compose': {'project': project_name} if project_name else {}
     }
@@ -194,28 +284,82 @@ def get_config_stack(*, project_name=None, project_config=None) -> Mapping:
     stack = [
         defaults,
         # Standard stack
-        *(
-            config
-            for config, _ in _get_file_stack(
-                project_name=project_name,
-                project_config=project_config,
-            )
-        ),
+        *(config for config, _ in files),
     ]
     if project_config and not isinstance(project_config, str):
         stack += [project_config]
 
-    return ConfigStack(*reversed(stack))
+    return UnholyStack(
+        config=ConfigStack(*reversed(stack)),
+        scripts=[script for _, script in files],
+    )
+
+
+def get_config_stack(*, project_name=None, project_config=None) -> Mapping:
+    """
+    Get the complete configuration stack up for a given project.
+
+    Also applies defaults.
+    """
+    return get_stack(project_name=project_name, project_config=project_config).config
 
 
 def get_script_stack(*, project_name=None, project_config=None) -> Iterable[str]:
     """
     Get the complete configuration script stack.
     """
-    return [
-        script
-        for _, script in _get_file_stack(
-            project_name=project_name,
-            project_config=project_config,
-        )
-    ]
+    return get_stack(project_name=project_name, project_config=project_config).scripts
+
+
+def _file_stamp(path: pathlib.Path) -> None | list[int]:
+    """
+    Something that changes when the file does.
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def project_index() -> dict[str, dict]:
+    """
+    Get where every local project lives.
+
+    Maps project names to dicts of ``context``, ``project`` (the compose
+    project name), and ``volume`` (the workspace name). This is kept on
+    disk, and projects are only looked at again when their files change.
+
+    Note that this doesn't take the workspace Unholyfile into account.
+    """
+    index_path = cache_path() / 'projects.json'
+    try:
+        index = json.loads(index_path.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        index = {}
+
+    # The user Unholyfile applies to everything
+    user_stamp = _file_stamp(config_path() / 'Unholyfile')
+    if index.get('user') != user_stamp:
+        index = {'user': user_stamp}
+    old_projects = index.get('projects', {})
+
+    projects = {}
+    for path in list_project_paths():
+        name = path.stem
+        stamp = _file_stamp(path)
+        if name in old_projects and old_projects[name]['stamp'] == stamp:
+            projects[name] = old_projects[name]
+            continue
+        config = get_config_stack(project_name=name)
+        projects[name] = {
+            'stamp': stamp,
+            'context': config.get('context'),
+            'project': config.get('compose', {}).get('project') or name,
+            'volume': config.get('dev', {}).get('volume'),
+        }
+
+    if projects != old_projects:
+        index['projects'] = projects
+        index_path.write_text(json.dumps(index), encoding='utf-8')
+    return projects
@@ -1,11 +1,22 @@
+import dataclasses
 import functools
-import io
+import itertools
+import json
 import os
 from pathlib import Path
+import queue
+import selectors
+import shlex
+import socket
+import ssl
+import stat
+import struct
 import subprocess
 import sys
 import tarfile
+import threading
 import time
+from typing import Iterable, Iterator
 
 import click
 import docker
@@ -15,6 +26,9 @@ import docker.types
 from docker.transport.unixconn import UnixHTTPAdapter
 import docker.utils
 
+from .config import cache_path
+from .junk_drawer import IterReader, TailBuffer, tar_blob, tar_dir, tar_stream
+
 
 class ContextNotExistError(ValueError):
     """
@@ -65,30 +79,236 @@ def socket_path(client) -> None | Path:
         return adapter.socket_path
 
 
-def smart_pull(client, image) -> docker.models.images.Image:
+#: The image pull policies understood by :func:`smart_pull`
+PULL_POLICIES = ('always', 'missing', 'if-older-than')
+
+
+def _pull_records_path() -> Path:
+    return cache_path() / 'pulls.json'
+
+
+def _load_pull_records() -> dict:
     """
-    Pulls the given image with click progress.
+    Load when each image was last checked against its registry.
+    """
+    try:
+        return json.loads(_pull_records_path().read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _record_pull(ref: str, img: docker.models.images.Image):
+    """
+    Note that the image was just checked against its registry.
+    """
+    records = _load_pull_records()
+    records[ref] = {
+        'checked': time.time(),
+        'id': img.id,
+        'digests': img.attrs.get('RepoDigests', []),
+    }
+    _pull_records_path().write_text(json.dumps(records), encoding='utf-8')
+
+
+def _split_ref(image: str) -> tuple[str, str, str]:
+    """
+    Split an image reference into repository, tag, and the normalized reference.
     """
     repository, image_tag = docker.utils.parse_repository_tag(image)
     tag = image_tag or 'latest'
+    ref = f"{repository}{'@' if tag.startswith('sha256:') else ':'}{tag}"
+    return repository, tag, ref
 
-    with click.progressbar(
-        client.api.pull(repository, tag=tag, stream=True, decode=True),
-        label='Pulling',
-        item_show_func=lambda item: (
-            item.get('status', None) if isinstance(item, dict) else str(item)
-        ),
-    ) as bar:
-        for line in bar:
-            # print(f"{line=}")
-            if 'progressDetail' not in line:
-                continue
-            if 'total' in line['progressDetail']:
-                bar.length = line['progressDetail']['total']
-            if 'current' in line['progressDetail']:
-                bar.update(line['progressDetail']['current'], line)
 
-    return client.images.get(f"{repository}{'@' if tag.startswith('sha256:') else ':'}{tag}")
+def _local_if_current(
+    client, image: str, policy: str, max_age: float | None,
+) -> None | docker.models.images.Image:
+    """
+    Get the local copy of the image if the policy says it doesn't need pulling.
+    """
+    if policy not in PULL_POLICIES:
+        raise ValueError(f"Unknown pull policy {policy!r}")
+    _, tag, ref = _split_ref(image)
+
+    if policy != 'always' or tag.startswith('sha256:'):
+        try:
+            local = client.images.get(ref)
+        except docker.errors.ImageNotFound:
+            return None
+        if policy != 'if-older-than' or tag.startswith('sha256:'):
+            return local
+        record = _load_pull_records().get(ref)
+        # The record is only good if it's about the image we have
+        if record is not None and record['id'] == local.id \
+                and time.time() - record['checked'] < (max_age or 0):
+            return local
+
+
+class _PullProgress:
+    """
+    Sums up the per-layer progress of several pulls.
+    """
+
+    def __init__(self):
+        #: (image, layer) -> [current, total]
+        self.layers = {}
+
+    def feed(self, image: str, line: dict):
+        if 'id' not in line:
+            return
+        layer = self.layers.setdefault((image, line['id']), [0, 0])
+        detail = line.get('progressDetail') or {}
+        match line.get('status'):
+            case 'Downloading':
+                layer[0] = detail.get('current', layer[0])
+                layer[1] = detail.get('total', layer[1])
+            case 'Download complete' | 'Pull complete' | 'Already exists':
+                layer[0] = layer[1]
+
+    @property
+    def current(self) -> int:
+        return sum(c for c, _ in self.layers.values())
+
+    @property
+    def total(self) -> int:
+        return sum(t for _, t in self.layers.values())
+
+
+def _pull_worker(client, image: str, results: queue.Queue):
+    """
+    Run a pull, sending (image, line) pairs to results, then (image, None).
+    """
+    repository, tag, _ = _split_ref(image)
+    try:
+        for line in client.api.pull(repository, tag=tag, stream=True, decode=True):
+            if 'error' in line:
+                raise docker.errors.DockerException(f"Unable to pull {image}: {line['error']}")
+            results.put((image, line))
+    except Exception as exc:
+        results.put((image, exc))
+    else:
+        results.put((image, None))
+
+
+def pull_many(
+    client, images: Iterable[str], *,
+    policy: str = 'always', max_age: float | None = None,
+) -> dict[str, docker.models.images.Image]:
+    """
+    Pulls several images at once, with combined click progress.
+
+    Returns a dict of the requested references to the pulled images.
+
+    See :func:`smart_pull` for the arguments.
+    """
+    found = {}
+    to_pull = []
+    for image in dict.fromkeys(images):
+        if (local := _local_if_current(client, image, policy, max_age)) is not None:
+            found[image] = local
+        else:
+            to_pull.append(image)
+
+    if to_pull:
+        results = queue.Queue()
+        progress = _PullProgress()
+        errors = []
+        for image in to_pull:
+            threading.Thread(
+                target=_pull_worker, args=(client, image, results), daemon=True,
+            ).start()
+
+        with click.progressbar(
+            length=1,
+            label=f"Pulling {', '.join(to_pull)}",
+            item_show_func=lambda item: (
+                item.get('status', None) if isinstance(item, dict) else None
+            ),
+        ) as bar:
+            running = len(to_pull)
+            while running:
+                image, line = results.get()
+                if line is None or isinstance(line, Exception):
+                    running -= 1
+                    if line is not None:
+                        errors.append(line)
+                    continue
+                progress.feed(image, line)
+                bar.length = max(progress.total, 1)
+                bar.update(progress.current - bar.pos, line)
+                # The total grows as layers are discovered
+                if bar.pos < bar.length:
+                    bar.finished = False
+
+        if errors:
+            raise errors[0]
+
+        for image in to_pull:
+            _, _, ref = _split_ref(image)
+            found[image] = client.images.get(ref)
+            _record_pull(ref, found[image])
+
+    return found
+
+
+def smart_pull(
+    client, image, *,
+    policy: str = 'always', max_age: float | None = None,
+) -> docker.models.images.Image:
+    """
+    Pulls the given image with click progress.
+
+    Images pinned by digest are never pulled if they're already available.
+
+    Args:
+        client: The docker client
+        image: The image reference
+        policy: When to pull: ``always``, if ``missing`` locally, or
+            ``if-older-than`` max_age seconds since it was last checked
+        max_age: For ``if-older-than``, in seconds
+    """
+    return pull_many(client, [image], policy=policy, max_age=max_age)[image]
+
+
+def stat_path(container: docker.models.containers.Container, path: str) -> dict:
+    """
+    Get information about a path in a container, without transferring it.
+
+    Returns the same stat that :meth:`docker.api.container.ContainerApiMixin.get_archive`
+    does (``name``, ``size``, ``mode``, ``mtime``, ``linkTarget``).
+
+    Raises:
+        docker.errors.NotFound: If the path doesn't exist
+    """
+    api = container.client.api
+    res = api.head(
+        api._url('/containers/{0}/archive', container.id),
+        params={'path': path},
+        timeout=api.timeout,
+    )
+    api._raise_for_status(res)
+    return docker.utils.decode_json_header(res.headers['x-docker-container-path-stat'])
+
+
+def read_file(container: docker.models.containers.Container, path: str) -> tuple[bytes, dict]:
+    """
+    Read a file out of a container.
+
+    Returns the contents, and the stat (see :func:`stat_path`).
+
+    Raises:
+        FileNotFoundError: If there's no such file
+    """
+    try:
+        chunks, stat = container.get_archive(path)
+    except docker.errors.NotFound as exc:
+        raise FileNotFoundError(f"{path} not found in container") from exc
+    # Stream it, and stop reading as soon as we have the file
+    with IterReader(chunks) as reader, tarfile.open(fileobj=reader, mode='r|') as tf:
+        for member in tf:
+            if member.isfile():
+                return tf.extractfile(member).read(), stat
+    raise FileNotFoundError(f"{path} in container is not a file")
 
 
 def mount(mountpoint: str, volume: docker.models.volumes.Volume, **opts) -> docker.types.Mount:
@@ -139,58 +359,210 @@ class DockerExec:
         """
         return self.api.exec_start(self.id, **opts)
 
-    def start_with_pipes(self, *, stdin=None, stdout=None, stderr=None, tty=False):
+    def start_with_pipes(self, *, stdin=None, stdout=None, stderr=None, tty=False) -> int:
         """
         Start the command, but handle passing data between everything.
+
+        Input and output are handled at the same time, so neither side can
+        block the other. Once all of stdin has been sent, the process sees EOF.
+
+        Args:
+            stdin: bytes or a binary file object to send to the process. The
+                exec must have been created with ``stdin=True``.
+            stdout: Called with each chunk of stdout
+            stderr: Called with each chunk of stderr
+            tty: If the exec was created with a tty
+
+        Returns:
+            The exit code of the process
+
+        Raises:
+            RuntimeError: If there's stdin, but the daemon is reached over TLS
         """
+        if stdin is not None and self.api.base_url.startswith('https://'):
+            # A TLS connection can't be half-closed, so the process would never
+            # see EOF and wait forever.
+            raise RuntimeError("Sending stdin to a process isn't supported over TLS connections")
         sock = self.start(
             detach=False, tty=tty, stream=False, socket=True, demux=False,
         )
-        # I think stdin is just the raw stream?
-        sock  # Make flake8 happy
-
-        raise NotImplementedError
+        # The hijacked connection is the raw stream in, multiplexed frames out
+        raw = getattr(sock, '_sock', sock)
+        _PipeEngine(
+            raw, stdin,
+            outputs={
+                docker.utils.socket.STDOUT: stdout or (lambda chunk: None),
+                docker.utils.socket.STDERR: stderr or (lambda chunk: None),
+            },
+            tty=tty,
+        ).run()
+        sock.close()
+
+        return self.inspect()['ExitCode']
 
     # TODO: Look into sending signals
 
 
-def container_run(
+class _PipeEngine:
+    """
+    Moves data between a hijacked exec connection and our side.
+    """
+    CHUNK_SIZE = 64 * 1024
+    _WOULD_BLOCK = (BlockingIOError, InterruptedError, socket.timeout, ssl.SSLWantReadError, ssl.SSLWantWriteError)
+
+    def __init__(self, raw, stdin, outputs, tty):
+        self.raw = raw
+        self.outputs = outputs
+        self.tty = tty
+        #: Received data that isn't a complete frame yet
+        self.inbuf = bytearray()
+        #: Data waiting to be sent
+        self.outbuf = b''
+        #: File object stdin is being read from, if any
+        self.source = None
+        #: If the process was given stdin at all
+        self.has_stdin = stdin is not None
+        #: If stdin still has more to send
+        self.sending = stdin is not None
+        if isinstance(stdin, (bytes, bytearray, memoryview)):
+            self.outbuf = bytes(stdin)
+            # Empty input is already all sent
+            self.sending = bool(self.outbuf)
+        elif stdin is not None:
+            self.source = stdin
+
+    def _source_fd(self) -> int | None:
+        """
+        The fd to select on for stdin, or None to just read it.
+        """
+        try:
+            fd = self.source.fileno()
+            # Regular files are always ready, and epoll refuses them
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                return None
+        except (AttributeError, OSError, ValueError):
+            return None
+        return fd
+
+    def run(self):
+        if not self.sending:
+            self._close_write()
+        self.raw.setblocking(False)
+        with selectors.DefaultSelector() as sel:
+            sel.register(self.raw, selectors.EVENT_READ)
+            source_fd = self._source_fd() if self.source is not None else None
+            watching_source = False
+            while True:
+                self._refill(source_fd)
+                # Only wait on stdin when there's room to take more
+                want_source = self.sending and not self.outbuf and source_fd is not None
+                if want_source != watching_source:
+                    if want_source:
+                        try:
+                            sel.register(source_fd, selectors.EVENT_READ)
+                        except (OSError, ValueError):
+                            # Can't be selected on after all, so just read it
+                            source_fd = None
+                            continue
+                    else:
+                        sel.unregister(source_fd)
+                    watching_source = want_source
+                sel.modify(
+                    self.raw,
+                    selectors.EVENT_READ | (selectors.EVENT_WRITE if self.outbuf else 0),
+                )
+
+                for key, mask in sel.select():
+                    if key.fileobj == source_fd:
+                        self._read_source(os.read(source_fd, self.CHUNK_SIZE))
+                        continue
+                    if mask & selectors.EVENT_WRITE:
+                        self._send()
+                    if mask & selectors.EVENT_READ:
+                        if not self._receive():
+                            # Process is done, whether or not it took all its input
+                            return
+
+    def _refill(self, source_fd):
+        """
+        Read more stdin from file objects that can't be selected on.
+        """
+        if self.sending and not self.outbuf and self.source is not None and source_fd is None:
+            self._read_source(self.source.read(self.CHUNK_SIZE))
+
+    def _read_source(self, data: bytes):
+        if data:
+            self.outbuf = data
+        else:
+            self.sending = False
+            self._close_write()
+
+    def _send(self):
+        try:
+            sent = self.raw.send(self.outbuf)
+        except self._WOULD_BLOCK:
+            return
+        except BrokenPipeError:
+            # The process won't take any more
+            sent = len(self.outbuf)
+            self.sending = False
+        self.outbuf = self.outbuf[sent:]
+        if not self.outbuf and self.sending and self.source is None:
+            self.sending = False
+            self._close_write()
+
+    def _receive(self) -> bool:
+        """
+        Read what's available. Returns False at EOF.
+        """
+        while True:
+            try:
+                data = self.raw.recv(self.CHUNK_SIZE)
+            except self._WOULD_BLOCK:
+                return True
+            if not data:
+                return False
+            self._demux(data)
+            # TLS may hold decrypted data that select() doesn't know about
+            if not getattr(self.raw, 'pending', lambda: 0)():
+                return True
+
+    def _demux(self, data: bytes):
+        if self.tty:
+            self.outputs[docker.utils.socket.STDOUT](data)
+            return
+        self.inbuf += data
+        while len(self.inbuf) >= 8:
+            stream, size = struct.unpack('>BxxxL', self.inbuf[:8])
+            if len(self.inbuf) < 8 + size:
+                break
+            self.outputs[stream](bytes(self.inbuf[8:8 + size]))
+            del self.inbuf[:8 + size]
+
+    def _close_write(self):
+        """
+        Half-close, so the process sees EOF on stdin.
+        """
+        if isinstance(self.raw, ssl.SSLSocket):
+            # Shutting down a TLS socket takes down both directions
+            if self.has_stdin:
+                raise RuntimeError("Can't send EOF to a process over a TLS connection")
+            return
+        try:
+            self.raw.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+def _exec_start(
     container, cmd, *,
-    stdout=None, stderr=None,
-    check: bool = False,
     cwd: str | None = None,
     env: dict[str, str] | None = None,
-    encoding: str | None = None,
-    errors: str = 'strict',
     tty=False,
-) -> subprocess.CompletedProcess:
+) -> tuple[DockerExec, Iterator[tuple[int, bytes]]]:
     """
-    Presents a subprocess-like interface to container processes.
+    Start a process in the container, and get its output frames.
     """
-    if stdout is None:
-        sys.stdout.flush()
-        pipe_out = sys.stdout.buffer
-    elif stdout is subprocess.DEVNULL:
-        pipe_out = open(os.devnull, 'wb')
-    elif stdout is subprocess.PIPE:
-        pipe_out = io.BytesIO()
-    else:
-        pipe_out = stdout
-        # FIXME: Handle if we're handed a text-mode pipe
-
-    if stderr is None:
-        sys.stderr.flush()
-        pipe_err = sys.stderr.buffer
-    elif stderr is subprocess.DEVNULL:
-        pipe_err = open(os.devnull, 'wb')
-    elif stderr is subprocess.PIPE:
-        pipe_err = io.BytesIO()
-    elif stderr is subprocess.STDOUT:
-        pipe_err = pipe_out
-    else:
-        pipe_err = stderr
-        # FIXME: Handle if we're handed a text-mode pipe
-
     exec = DockerExec.create(
         container, cmd=list(map(str, cmd)),
         stdout=True, stderr=True,
@@ -198,24 +570,128 @@ def container_run(
         environment=env, workdir=cwd, tty=tty,
     )
     sock = exec.start(
-        detach=False, tty=False, stream=False, socket=True,
+        detach=False, tty=tty, stream=False, socket=True,
         demux=False,
     )
+    return exec, docker.utils.socket.frames_iter(sock, tty)
 
-    pipemap = {
-        docker.utils.socket.STDOUT: pipe_out,
-        docker.utils.socket.STDERR: pipe_err,
-    }
 
-    for pipe, chunk in docker.utils.socket.frames_iter(sock, False):
-        pipemap[pipe].write(chunk)
+def container_iter(
+    container, cmd, *,
+    check: bool = False,
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+    tty=False,
+) -> Iterator[tuple[int, bytes]]:
+    """
+    Runs a process in the container, yielding its output as it happens.
 
-    info = exec.inspect()
+    Yields ``(stream, chunk)``, where stream is 1 for stdout and 2 for stderr.
+    (With a tty, everything is stdout.) Nothing is buffered.
 
-    assert not info['Running']
-    retcode = info['ExitCode']
-    outval = pipe_out.getvalue() if isinstance(pipe_out, io.BytesIO) else None
-    errval = pipe_err.getvalue() if isinstance(pipe_err, io.BytesIO) else None
+    Raises:
+        subprocess.CalledProcessError: At the end, if check and the process failed
+    """
+    exec, frames = _exec_start(container, cmd, cwd=cwd, env=env, tty=tty)
+    yield from frames
+    retcode = exec.inspect()['ExitCode']
+    if check and retcode:
+        raise subprocess.CalledProcessError(retcode, cmd)
+
+
+def _sink(target, console, tail: int | None):
+    """
+    Work out where output goes for :func:`container_run`.
+
+    Returns a write function and a function to get the captured output (or None).
+    """
+    if target is None:
+        console.flush()
+        write, getvalue = console.buffer.write, None
+    elif target is subprocess.DEVNULL:
+        write, getvalue = (lambda chunk: None), None
+    elif target is subprocess.PIPE:
+        chunks = []
+        return chunks.append, lambda: b''.join(chunks)
+    elif callable(target):
+        write, getvalue = target, None
+    else:
+        # FIXME: Handle if we're handed a text-mode pipe
+        write, getvalue = target.write, None
+
+    if tail:
+        buffer = TailBuffer(tail)
+
+        def write(chunk, *, _write=write):
+            _write(chunk)
+            buffer.write(chunk)
+
+        getvalue = buffer.getvalue
+    return write, getvalue
+
+
+def container_run(
+    container, cmd, *,
+    stdout=None, stderr=None,
+    check: bool = False,
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+    encoding: str | None = None,
+    errors: str = 'strict',
+    tty=False,
+    tail: int | None = None,
+    input: str | bytes | None = None,
+    stdin=None,
+) -> subprocess.CompletedProcess:
+    """
+    Presents a subprocess-like interface to container processes.
+
+    In addition to what :func:`subprocess.run` accepts, stdout and stderr may
+    be callables, which are called with each chunk of output as it arrives.
+
+    Args:
+        tail: If output isn't being captured with PIPE, still keep the last
+            this-many bytes of it for the result (and any error)
+        input: Data to send to the process
+        stdin: A binary file object to send to the process
+    """
+    if input is not None and stdin is not None:
+        raise ValueError("stdin and input arguments may not both be used.")
+    if isinstance(input, str):
+        input = input.encode(encoding or 'utf-8', errors)
+
+    write_out, get_out = _sink(stdout, sys.stdout, tail)
+    if stderr is subprocess.STDOUT:
+        write_err, get_err = write_out, (lambda: None)
+    else:
+        write_err, get_err = _sink(stderr, sys.stderr, tail)
+
+    if input is not None or stdin is not None:
+        exec = DockerExec.create(
+            container, cmd=list(map(str, cmd)),
+            stdin=True, stdout=True, stderr=True,
+            environment=env, workdir=cwd, tty=tty,
+        )
+        retcode = exec.start_with_pipes(
+            stdin=input if input is not None else stdin,
+            stdout=write_out, stderr=write_err, tty=tty,
+        )
+    else:
+        exec, frames = _exec_start(container, cmd, cwd=cwd, env=env, tty=tty)
+
+        pipemap = {
+            docker.utils.socket.STDOUT: write_out,
+            docker.utils.socket.STDERR: write_err,
+        }
+
+        for pipe, chunk in frames:
+            pipemap[pipe](chunk)
+
+        info = exec.inspect()
+        assert not info['Running']
+        retcode = info['ExitCode']
+    outval = get_out() if get_out is not None else None
+    errval = get_err() if get_err is not None else None
     if encoding:
         if outval is not None:
             outval = outval.decode(encoding, errors)
@@ -228,47 +704,265 @@ def container_run(
     else:
         return subprocess.CompletedProcess(
             args=cmd,
-            returncode=info['ExitCode'],
+            returncode=retcode,
             stdout=outval,
             stderr=errval,
         )
 
 
-def inject_and_run(
+@dataclasses.dataclass
+class ScriptResult:
+    """
+    How one script of :func:`inject_and_run_many` went.
+    """
+    #: Name of the script
+    name: str
+    #: Exit code
+    returncode: int
+    #: How long it ran, in seconds
+    duration: int
+
+
+#: Prefix of the lines the batch driver reports results with
+_SCRIPT_MARKER = b'::unholy-script::'
+
+_BATCH_DRIVER = """#!/bin/sh
+dir=$(dirname "$0")
+trap 'rm -rf "$dir"' EXIT
+for name in {names}; do
+    start=$(date +%s)
+    "$dir/$name"
+    rc=$?
+    # On a line of its own, even if the script didn't end its last one
+    printf '\\n{marker} %s %s %s\\n' "$name" "$rc" "$(( $(date +%s) - start ))"
+    [ $rc -eq 0 ] || exit $rc
+done
+"""
+
+
+class _ScriptReporter:
+    """
+    Passes output through, while picking out the driver's result lines.
+
+    Output is passed on as it comes, except for the start of a line that
+    might be a result line, which is held until it's clear.
+    """
+
+    def __init__(self, write, report):
+        self.write = write
+        self.report = report
+        #: The start of a line that might be a result line
+        self.held = b''
+        #: If the start of the current line has already been passed through
+        self.mid_line = False
+        self.results = []
+
+    def __call__(self, chunk: bytes):
+        data = self.held + chunk
+        self.held = b''
+        while data:
+            end = data.find(b'\n') + 1 or len(data)
+            line, data = data[:end], data[end:]
+            complete = line.endswith(b'\n')
+            if not self.mid_line:
+                if line.startswith(_SCRIPT_MARKER) and complete:
+                    name, rc, duration = line[len(_SCRIPT_MARKER):].decode('utf-8').strip().rsplit(' ', 2)
+                    result = ScriptResult(name, int(rc), int(duration))
+                    self.results.append(result)
+                    self.report(result)
+                    continue
+                elif _SCRIPT_MARKER.startswith(line) or line.startswith(_SCRIPT_MARKER):
+                    self.held = line
+                    return
+            self.write(line)
+            self.mid_line = not complete
+
+
+def print_script_results(results: Iterable[ScriptResult]):
+    """
+    Print how each script went.
+    """
+    for result in results:
+        if result.returncode:
+            click.secho(f"  {result.name}: failed ({result.returncode}) after {result.duration}s", fg='red')
+        else:
+            click.secho(f"  {result.name}: ok in {result.duration}s", fg='green')
+
+
+def inject_and_run_many(
     container: docker.models.containers.Container,
-    script: str,
-    name: str = 'injected-script',
-    **opts
-):
+    scripts: Iterable[tuple[str, str]],
+    *,
+    dirname: str = 'unholyscripts',
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+    tail: int = 16 * 1024,
+) -> list[ScriptResult]:
     """
-    Loat the given script into the container, and then run it with
-    :func:`container_run`.
+    Load several scripts into the container, and run them in order.
+
+    This takes one upload and one exec. Running stops at the first script
+    that fails, and the scripts are cleaned up by the same exec.
+
+    Args:
+        scripts: Pairs of (name, script)
+        dirname: Directory (under ``/``) to put the scripts in
+        cwd: Where to run the scripts
+        env: Extra environment variables for the scripts
+        tail: How much of the end of the output to keep for the error
+
+    Raises:
+        subprocess.CalledProcessError: If a script fails, with the end of the
+            output as ``output``
     """
+    scripts = list(scripts)
     # Note: Cannot inject files into the tmpfs
-    buffer = io.BytesIO()
-    with tarfile.open(fileobj=buffer, mode='w:') as tf:
-        ti = tarfile.TarInfo(name)
-        bscript = script.encode('utf-8')
-        ti.size = len(bscript)
-        ti.mode = 0o755
-        tf.addfile(ti, fileobj=io.BytesIO(bscript))
-    buffer.seek(0)
-    container.put_archive('/', buffer)
+    container.put_archive('/', tar_stream(itertools.chain(
+        tar_dir(dirname, mode=0o700),
+        *(
+            tar_blob(f"{dirname}/{name}", script, mode=0o755)
+            for name, script in scripts
+        ),
+        tar_blob(
+            f"{dirname}/run",
+            _BATCH_DRIVER.format(
+                names=' '.join(shlex.quote(name) for name, _ in scripts),
+                marker=_SCRIPT_MARKER.decode('utf-8'),
+            ),
+            mode=0o755,
+        ),
+    )))
+
+    sys.stdout.flush()
+
+    def write(chunk):
+        sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+
+    reporter = _ScriptReporter(write, lambda result: print_script_results([result]))
+    proc = container_run(
+        container, [f'/{dirname}/run'],
+        stdout=reporter, cwd=cwd, env=env, tty=True, tail=tail,
+    )
+    for result in reporter.results:
+        if result.returncode:
+            raise subprocess.CalledProcessError(result.returncode, [result.name], output=proc.stdout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, output=proc.stdout)
+    return reporter.results
+
+
+#: Statuses that come from the container's health check instead of its state
+HEALTH_STATUSES = {'starting', 'healthy', 'unhealthy'}
+
+
+def _has_status(cont: docker.models.containers.Container, status: str) -> bool:
+    """
+    Checks the container's (already loaded) status.
+    """
+    if status in HEALTH_STATUSES:
+        return cont.attrs['State'].get('Health', {}).get('Status') == status
+    else:
+        return cont.status == status
+
+
+def wait_for_status(
+    cont: docker.models.containers.Container, status: str, *,
+    timeout: float | None = None,
+):
+    """
+    Wait for the container to reach the given status.
+
+    Listens to the daemon's event stream for changes to the container, and falls
+    back to polling if that doesn't work out. (Over SSH, the stream can't be
+    closed to enforce a timeout or clean up, so it's straight to polling.)
+
+    Args:
+        cont: The container to watch
+        status: A container status (``running``, ``exited``, etc) or health
+            status (``healthy``, etc)
+        timeout: How long to wait, in seconds, or None for forever
+
+    Raises:
+        TimeoutError: If the status wasn't reached in time
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    # Subscribe before checking so that no change is missed in between
+    if cont.client.api.base_url.startswith('http+docker://ssh'):
+        events = None
+    else:
+        try:
+            events = cont.client.api.events(
+                filters={'type': 'container', 'container': cont.id},
+                decode=True,
+            )
+        except docker.errors.APIError:
+            events = None
 
     try:
-        container_run(
-            container, [f'/{name}'],
-            check=True, tty=True,
-        )
+        cont.reload()
+        if _has_status(cont, status):
+            return
+        if events is not None and _wait_for_event(cont, status, events, deadline):
+            return
     finally:
-        container_run(
-            container, ['rm', '-rf', f'/{name}'],
-            check=True,
-        )
+        if events is not None:
+            _close_events(events)
+
+    _poll_for_status(cont, status, deadline)
 
 
-def wait_for_status(cont: docker.models.containers.Container, status):
+def _close_events(events):
+    """
+    Close an event stream, if the transport allows it.
+    """
+    try:
+        events.close()
+    except docker.errors.DockerException:
+        pass
+
+
+def _wait_for_event(cont, status, events, deadline) -> bool:
+    """
+    Wait on the event stream. Returns False if the stream stopped working.
+    """
+    timer = None
+    if deadline is not None:
+        timer = threading.Timer(deadline - time.monotonic(), _close_events, [events])
+        timer.start()
+    try:
+        for _ in events:
+            # Events are just a hint, the status is authoritative
+            cont.reload()
+            if _has_status(cont, status):
+                return True
+    except docker.errors.NotFound:
+        raise
+    except Exception:
+        # Stream got closed or broke
+        pass
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError(f"Container {cont.name} did not become {status}")
+    return False
+
+
+def _poll_for_status(cont, status, deadline, *, initial=0.05, maximum=2.0):
+    """
+    Poll the container with exponential backoff.
+    """
+    delay = initial
     cont.reload()
-    while cont.status != status:
-        time.sleep(0.1)
+    while not _has_status(cont, status):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Container {cont.name} did not become {status}")
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        delay = min(delay * 2, maximum)
         cont.reload()
@@ -1,8 +1,14 @@
+import hashlib
 import io
+import json
 import os
+import re
 import subprocess
 import tarfile
 import tempfile
+import urllib.parse
+
+from .config import cache_path
 
 
 # This series of functions based on
@@ -13,21 +19,25 @@ def pull_file(
 ) -> str | bytes:
     """
     Pull a specific file from a remote repo, without doing a full checkout.
+
+    The ref is resolved with ``git ls-remote``, and files are cached by commit,
+    so asking again for an unchanged ref doesn't fetch anything else.
+
+    Raises:
+        FileNotFoundError: If the file isn't in the repo
     """
     branch = branch or 'HEAD'
-    if 'github.com' in repo:
-        # GitHub doesn't support `git archive`, don't bother trying
-        raw = _pull_file_github(repo, branch, path)
-    try:
-        # Try with `git archive`
-        raw = _pull_file_archive(repo, branch, path)
-    except Exception as exc:
-        # Try as github anyway, might be self-hosted or other shenanigans
-        try:
-            raw = _pull_file_github(repo, branch, path)
-        except Exception:
-            # That also failed, raise the original exception
-            raise exc
+    commit = _resolve_ref(repo, branch)
+    if commit is not None:
+        raw = _cached_pull(
+            repo, commit, path,
+            fetch=lambda: _pull_file_any(repo, branch, path),
+            # Fetching goes by ref, so make sure it got the commit we looked up
+            still_current=lambda: _resolve_ref(repo, branch) == commit,
+        )
+    else:
+        # Not a ref (maybe a commit), so nothing to key a cache on
+        raw = _pull_file_any(repo, branch, path)
 
     if encoding is not None:
         return raw.decode(encoding)
@@ -35,6 +45,118 @@ def pull_file(
         return raw
 
 
+def _resolve_ref(repo: str, branch: str) -> str | None:
+    """
+    Get the commit a remote ref points to, or None if it's not a ref.
+    """
+    if re.fullmatch(r'[0-9a-f]{40}|[0-9a-f]{64}', branch):
+        return branch
+    proc = subprocess.run(
+        ['git', 'ls-remote', repo, branch],
+        stdout=subprocess.PIPE, text=True, check=True,
+    )
+    refs = {}
+    for line in proc.stdout.splitlines():
+        commit, _, name = line.partition('\t')
+        refs[name] = commit
+    # Same precedence as git: branches over tags, and tags peeled to commits
+    for name in (branch, f'refs/heads/{branch}', f'refs/tags/{branch}^{{}}', f'refs/tags/{branch}'):
+        if name in refs:
+            return refs[name]
+    return None
+
+
+def _cached_pull(repo: str, commit: str, path: str, *, fetch, still_current) -> bytes:
+    """
+    Look up a file in the local cache, calling ``fetch`` to get it on a miss.
+
+    Files that aren't there are remembered too. What was fetched is only
+    cached if ``still_current()`` says it's from the same commit.
+    """
+    cachedir = cache_path() / 'files'
+    cachedir.mkdir(exist_ok=True)
+    key = hashlib.sha256(json.dumps([repo, commit, path]).encode('utf-8')).hexdigest()
+    cachefile = cachedir / key
+    missing = cachedir / f"{key}.missing"
+
+    if missing.exists():
+        raise FileNotFoundError(f"File {path} not in repo")
+    try:
+        return cachefile.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    try:
+        raw = fetch()
+    except FileNotFoundError:
+        if still_current():
+            missing.touch()
+        raise
+    if still_current():
+        cachefile.write_bytes(raw)
+    return raw
+
+
+def _repo_host(repo: str) -> str:
+    """
+    Get the host part of a git remote URL (empty for local repos).
+    """
+    if '://' in repo:
+        return urllib.parse.urlsplit(repo).hostname or ''
+    elif (m := re.match(r'(?:[^@/]+@)?([^:/]+):', repo)):
+        # scp-like, user@host:path
+        return m.group(1)
+    else:
+        return ''
+
+
+def _strategies_path():
+    return cache_path() / 'pull-strategies.json'
+
+
+def _pull_file_any(repo: str, branch: str, path: str) -> bytes:
+    """
+    Pull a file, trying each method until one works.
+
+    The method that works is remembered for the host and tried first next
+    time.
+    """
+    host = _repo_host(repo)
+    try:
+        known = json.loads(_strategies_path().read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        known = {}
+    strategies = list(_STRATEGIES)
+    if host in known and known[host] in _STRATEGIES:
+        strategies.remove(known[host])
+        strategies.insert(0, known[host])
+    elif host == 'github.com':
+        # GitHub doesn't support `git archive`, don't bother trying
+        strategies.remove('archive')
+
+    first_exc = None
+    for strategy in strategies:
+        try:
+            raw = _STRATEGIES[strategy](repo, branch, path)
+        except FileNotFoundError:
+            # The method works; the file just isn't there
+            found = False
+        except Exception as exc:
+            first_exc = first_exc or exc
+            continue
+        else:
+            found = True
+        if known.get(host) != strategy:
+            known[host] = strategy
+            _strategies_path().write_text(json.dumps(known), encoding='utf-8')
+        if found:
+            return raw
+        else:
+            raise FileNotFoundError(f"File {path} not in repo")
+    # Everything failed, raise the first exception
+    raise first_exc
+
+
 def _pull_file_archive(repo: str, branch: str, path: str) -> bytes:
     """
     Pull a file from a remote repo using `git-archive`.
@@ -47,8 +169,12 @@ def _pull_file_archive(repo: str, branch: str, path: str) -> bytes:
     # (ie, if git fails, say that instead of giving a tarfile error.)
     proc = subprocess.run(
         ['git', 'archive', f'--remote={repo}', branch, path],
-        stdout=subprocess.PIPE, text=False, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=False,
     )
+    if proc.returncode:
+        if b'did not match any files' in proc.stderr:
+            raise FileNotFoundError(f"File {path} not in repo")
+        raise subprocess.CalledProcessError(proc.returncode, proc.args, proc.stdout, proc.stderr)
     with tarfile.open(fileobj=io.BytesIO(proc.stdout), mode='r:*') as tf:
         try:
             member = tf.getmember(path)
@@ -92,6 +218,13 @@ def _pull_file_github(repo: str, branch: str, path: str) -> bytes:
             return f.read()
 
 
+#: Ways of pulling a single file, most efficient first
+_STRATEGIES = {
+    'archive': _pull_file_archive,
+    'clone': _pull_file_github,
+}
+
+
 def guess_project_from_url(url) -> str:
     """
     Given a git remote URL, guess the project name.
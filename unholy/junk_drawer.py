@@ -1,10 +1,19 @@
+import collections
 import io
+import os
+import pathlib
+import stat
 import tarfile
+from typing import Iterable, Iterator
 
 
-def tarfile_add(tf: tarfile.TarFile, name: str, contents: str | bytes, **props):
+#: A tar member: its header, and its contents (bytes, a path to read, or None)
+TarMember = tuple[tarfile.TarInfo, bytes | os.PathLike | None]
+
+
+def tar_blob(name: str, contents: str | bytes, **props) -> Iterator[TarMember]:
     """
-    Utility to add a file to a tarfile
+    A file for :func:`tar_stream`, from memory.
     """
     if isinstance(contents, str):
         contents = contents.encode('utf-8')
@@ -14,5 +23,127 @@ def tarfile_add(tf: tarfile.TarFile, name: str, contents: str | bytes, **props):
     ti.size = len(contents)
     for k, v in props.items():
         setattr(ti, k, v)
+    yield ti, contents
+
+
+def tar_dir(name: str, **props) -> Iterator[TarMember]:
+    """
+    A directory for :func:`tar_stream`.
+    """
+    ti = tarfile.TarInfo(name)
+    ti.type = tarfile.DIRTYPE
+    ti.mode = 0o755
+    for k, v in props.items():
+        setattr(ti, k, v)
+    yield ti, None
+
+
+def tar_path(name: str, path: str | os.PathLike, *, follow_symlinks: bool = False) -> Iterator[TarMember]:
+    """
+    A file, symlink, or whole directory tree for :func:`tar_stream`.
+
+    Contents aren't read until the archive is streamed.
+    """
+    path = pathlib.Path(path)
+    st = path.stat() if follow_symlinks else path.lstat()
+    ti = tarfile.TarInfo(name)
+    ti.mode = stat.S_IMODE(st.st_mode)
+    ti.mtime = int(st.st_mtime)
+    if stat.S_ISLNK(st.st_mode):
+        ti.type = tarfile.SYMTYPE
+        ti.linkname = os.readlink(path)
+        yield ti, None
+    elif stat.S_ISDIR(st.st_mode):
+        ti.type = tarfile.DIRTYPE
+        yield ti, None
+        for child in sorted(path.iterdir()):
+            yield from tar_path(f"{name}/{child.name}", child, follow_symlinks=follow_symlinks)
+    elif stat.S_ISREG(st.st_mode):
+        ti.type = tarfile.REGTYPE
+        ti.size = st.st_size
+        yield ti, path
+    # Anything else (sockets, devices, etc) is skipped
+
+
+def tar_stream(members: Iterable[TarMember], *, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Generate a tar archive chunk by chunk, suitable as a streaming request body.
+
+    Files are read as the archive is consumed, so memory use doesn't depend
+    on how big they are.
+    """
+    for ti, contents in members:
+        yield ti.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        if ti.type != tarfile.REGTYPE:
+            continue
+        if isinstance(contents, bytes):
+            yield contents
+        else:
+            remaining = ti.size
+            with open(contents, 'rb') as f:
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        # File shrank; the header already promised this much
+                        yield tarfile.NUL * remaining
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        if ti.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - ti.size % tarfile.BLOCKSIZE)
+    # End of archive
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class TailBuffer:
+    """
+    A write-only buffer that only keeps the last size bytes written.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._chunks = collections.deque()
+        self._length = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self._length += len(data)
+        # Drop whole chunks that are entirely out of the window
+        while self._chunks and self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
+        return len(data)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self._chunks)[-self.size:] if self.size else b''
+
+
+class IterReader(io.RawIOBase):
+    """
+    Read-only file-like view of an iterable of bytes chunks.
+
+    Chunks are pulled as they're needed, so nothing past what's been read is
+    buffered.
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        return count
 
-    tf.addfile(ti, io.BytesIO(contents))
+    def close(self):
+        if hasattr(self._chunks, 'close'):
+            self._chunks.close()
+        super().close()
@@ -1,15 +1,101 @@
+import hashlib
+import subprocess
+
 from .docker import container_run
 
 
-def do_clone(container, directory, config, *, branch=None, remote=None):
+#: Clone or update a mirror. Cloned under a temporary name first, so a failed
+#: clone isn't mistaken for a mirror later.
+_MIRROR_SCRIPT = """
+set -e
+if [ -d "$2" ]; then
+    git -C "$2" fetch --prune --quiet
+else
+    git clone --mirror --quiet "$1" "$2.$$"
+    mv "$2.$$" "$2"
+fi
+"""
+
+
+def mirror_update(container, root, repository) -> str | None:
+    """
+    Bring the shared bare mirror of the repository up to date.
+
+    Args:
+        root: Directory (in the container) that mirrors are kept in
+        repository: The URL being mirrored
+
+    Returns:
+        The path of the mirror in the container, or None if it couldn't be updated
+    """
+    path = f"{root}/{hashlib.sha256(repository.encode('utf-8')).hexdigest()[:16]}.git"
+    proc = container_run(
+        container, ['sh', '-c', _MIRROR_SCRIPT, 'mirror', repository, path],
+        stderr=subprocess.PIPE, encoding='utf-8', errors='replace',
+    )
+    if proc.returncode:
+        # Eg, another project is updating it right now; just clone normally
+        print(f"Unable to update mirror, skipping: {proc.stderr.strip()}")
+        return None
+    return path
+
+
+def do_clone(
+    container, directory, config, *, branch=None, remote=None,
+    depth=None, filter=None, sparse=None, reference=None,
+):
+    """
+    Clone the project repository into the workspace.
+
+    The clone options default to the ``clone`` table of the config. If
+    ``clone.mirror`` is set and there's no other reference, the shared mirror
+    (``cache.volumes.git-mirrors``) is updated and borrowed from. Shallow and
+    partial clones skip the mirror, since it would fetch everything.
+
+    Args:
+        depth: Only fetch this much history (0 for all of it)
+        filter: Partial clone filter, eg ``blob:none``
+        sparse: Directories to check out, instead of the whole tree
+        reference: Path (in the container) to a repository to borrow objects from
+    """
+    clone = config.get('clone', {})
+    depth = clone.get('depth', 0) if depth is None else depth
+    filter = clone.get('filter', '') if filter is None else filter
+    sparse = clone.get('sparse', []) if sparse is None else sparse
+    reference = clone.get('reference', '') if reference is None else reference
+
+    dissociate = clone.get('dissociate', True)
+    if not reference and not depth and not filter and clone.get('mirror', False):
+        cache = config.get('cache', {})
+        if cache.get('enabled', False) and (root := cache.get('volumes', {}).get('git-mirrors')):
+            reference = mirror_update(container, root, config['repository'])
+            # The mirror gets pruned, so don't depend on it
+            dissociate = True
+
     opts = []
     if remote:
         opts += ['--origin', remote]
     if branch:
         opts += ['--branch', branch]
+    if depth:
+        opts += ['--depth', str(depth)]
+    if filter:
+        opts += ['--filter', filter]
+    if sparse:
+        opts += ['--sparse']
+    if reference:
+        # --reference-if-able, so a missing mirror just means a slower clone
+        opts += ['--reference-if-able', reference]
+        if dissociate:
+            opts += ['--dissociate']
 
     container_run(
         container, ['git', 'clone', *opts, config['repository'], directory],
         # FIXME: Handle stdin for passwords and such
         check=True,
     )
+    if sparse:
+        container_run(
+            container, ['git', '-C', directory, 'sparse-checkout', 'set', '--cone', '--', *sparse],
+            check=True,
+        )